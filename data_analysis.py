@@ -2,9 +2,358 @@ import gradio as gr
 import pandas as pd
 import numpy as np
 import cv2
+import argparse
+import atexit
+import bisect
+import collections
+import cProfile
+import concurrent.futures
+import functools
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
 import os
+import pstats
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.styles import PatternFill
+from openpyxl.utils import get_column_letter
+
+# 備註:pyarrow 為選用套件,未安裝時不提供 Arrow 匯出
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
 
 # --- 1. Gel Image Analysis Logic ---
+
+# 備註:三個標記區域在影像中的高度比例 (起點, 終點)
+# ⚠️ 這些比例 (0.15, 0.25 等) 需依實際 Ladder 位置調整
+GEL_BAND_WINDOWS = {
+    "20k": (0.15, 0.25),
+    "5k": (0.45, 0.55),
+    "3k": (0.65, 0.75),
+}
+GEL_CACHE_SIZE = 4
+
+# 備註:電泳判定門檻
+# ⚠️ smear_brightness:Lane 平均亮度超過此值視為拖尾,可依樣本特性調整
+# ⚠️ band_brightness:標記區域最大亮度超過此值視為可見條帶
+GEL_THRESHOLDS = {
+    "smear_brightness": 50,
+    "band_brightness": 100,
+}
+
+
+def _upload_path(file_obj):
+    """取得上傳檔案路徑 (gr.File 物件或 filepath 字串皆可)"""
+    if file_obj is None:
+        return None
+    return getattr(file_obj, "name", file_obj)
+
+
+class GelDensitometry:
+    """
+    電泳影像密度分析
+    功能:每張影像只建立一次各 Lane 的列累積和與列最大值稀疏表,
+         之後 Lane 內任意列區段的總和 / 平均 / 最大值皆為 O(1) 查詢
+    備註:所有查詢都以 Lane 為單位,只保留每條 Lane 的一維表 (約每列數十 bytes),不保留整張影像大小的積分表
+    參數:
+        - img: 灰階影像 (背景為黑,亮度越高訊號越強)
+        - total_lanes: 總共有幾條 Lane
+    """
+
+    def __init__(self, img, total_lanes=14):
+        self.height, self.width = img.shape
+        self.total_lanes = total_lanes
+        self.lane_width = self.width // total_lanes
+
+        # Lane 切割方式與原本相同:最後一條可能只有剩餘的幾個像素欄
+        if self.lane_width > 0:
+            n_lanes = -(-self.width // self.lane_width)
+        else:
+            n_lanes = 0
+        self.lane_x0 = np.arange(n_lanes) * self.lane_width
+        self.lane_x1 = np.minimum(self.lane_x0 + self.lane_width, self.width)
+
+        # 各 Lane 的列累積和 (多一欄 0:row_cumsum[lane, y] = Lane 前 y 列的總和) 與列最大值
+        self.row_cumsum = np.zeros((n_lanes, self.height + 1), dtype=np.int64)
+        self.row_max = np.empty((n_lanes, self.height), dtype=img.dtype)
+        for lane, (x0, x1) in enumerate(zip(self.lane_x0, self.lane_x1)):
+            np.cumsum(img[:, x0:x1].sum(axis=1, dtype=np.int64), out=self.row_cumsum[lane, 1:])
+            self.row_max[lane] = img[:, x0:x1].max(axis=1)
+
+        self._build_sparse()
+
+    def _build_sparse(self):
+        # 稀疏表:level k 存放長度 2^k 區段的最大值
+        self._sparse = [self.row_max]
+        span = 1
+        while span * 2 <= self.height:
+            prev = self._sparse[-1]
+            self._sparse.append(np.maximum(prev[:, :-span], prev[:, span:]))
+            span *= 2
+
+    def __getstate__(self):
+        # 稀疏表可由 row_max 重建,跨程序傳遞時不傳送
+        state = self.__dict__.copy()
+        del state["_sparse"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_sparse()
+
+    @property
+    def lane_count(self):
+        return len(self.lane_x0)
+
+    def _check_lane(self, lane):
+        if not 0 <= lane < self.lane_count:
+            raise ValueError(f"Lane {lane} is outside the image")
+
+    @staticmethod
+    def _check_rows(y0, y1):
+        if y1 <= y0:
+            raise ValueError("Empty band window")
+
+    def band_sum(self, lane, y0, y1):
+        """Lane 在列 [y0, y1) 的亮度總和"""
+        self._check_lane(lane)
+        return int(self.row_cumsum[lane, y1] - self.row_cumsum[lane, y0])
+
+    def band_mean(self, lane, y0=0, y1=None):
+        """Lane 在列 [y0, y1) 的平均亮度 (預設整條 Lane)"""
+        y1 = self.height if y1 is None else y1
+        self._check_rows(y0, y1)
+        area = (y1 - y0) * (self.lane_x1[lane] - self.lane_x0[lane])
+        return self.band_sum(lane, y0, y1) / area
+
+    def band_max(self, lane, y0, y1):
+        """Lane 在列 [y0, y1) 的最大亮度 (稀疏表查詢)"""
+        self._check_lane(lane)
+        self._check_rows(y0, y1)
+        k = (y1 - y0).bit_length() - 1
+        table = self._sparse[k]
+        return max(table[lane, y0], table[lane, y1 - (1 << k)])
+
+    def window_rows(self, start_ratio, end_ratio):
+        """將高度比例轉為列範圍 (與 int(h*ratio) 切片一致)"""
+        return int(self.height * start_ratio), int(self.height * end_ratio)
+
+    def lane_profile(self, lane):
+        """
+        Lane 的強度剖面
+        回傳:長度為影像高度的陣列,每列為該 Lane 的平均亮度 (由上而下即遷移方向)
+        """
+        self._check_lane(lane)
+        return np.diff(self.row_cumsum[lane]) / (self.lane_x1[lane] - self.lane_x0[lane])
+
+    def smear_fraction(self, lane, windows=None):
+        """
+        拖尾量化
+        回傳:Lane 總訊號中落在標記區域以外的比例 (0~1)
+        """
+        windows = GEL_BAND_WINDOWS if windows is None else windows
+        total = self.band_sum(lane, 0, self.height)
+        if total == 0:
+            return 0.0
+        in_bands = sum(
+            self.band_sum(lane, *self.window_rows(start, end))
+            for start, end in windows.values()
+        )
+        return 1.0 - in_bands / total
+
+    def lane_statistics(self, lane):
+        """
+        analyze_gel_image 使用的 Lane 統計值
+        回傳:(平均亮度, 20k 最大亮度, 5k 最大亮度, 3k 最大亮度)
+        """
+        bands = [
+            self.band_max(lane, *self.window_rows(*GEL_BAND_WINDOWS[name]))
+            for name in ("20k", "5k", "3k")
+        ]
+        return (self.band_mean(lane), *bands)
+
+    def all_lane_statistics(self):
+        """
+        一次取得所有 Lane 的統計值 (供批次 / 向量化計算)
+        回傳:(平均亮度, 20k, 5k, 3k, 可分析遮罩),各為長度等於 Lane 數的陣列
+        """
+        stats = np.full((self.lane_count, 4), np.nan)
+        ok = np.zeros(self.lane_count, dtype=bool)
+        for lane in range(self.lane_count):
+            try:
+                stats[lane] = self.lane_statistics(lane)
+                ok[lane] = True
+            except ValueError:
+                pass
+        return stats[:, 0], stats[:, 1], stats[:, 2], stats[:, 3], ok
+
+    def profile_table(self):
+        """
+        所有 Lane 的強度剖面表,可直接用於繪圖
+        回傳:DataFrame - Position (0~1,由上而下) 與各 Lane 的平均亮度
+        """
+        positions = np.arange(self.height) / max(self.height - 1, 1)
+        table = {"Position": positions}
+        for lane in range(self.lane_count):
+            table[f"Lane {lane}"] = self.lane_profile(lane)
+        return pd.DataFrame(table)
+
+
+def read_gel_image(image_path):
+    """
+    讀取電泳影像
+    功能:讀取灰階影像,白色背景時自動反轉
+    回傳:灰階影像陣列,讀取失敗回傳 None
+    """
+    # 備註:讀取影像為灰階格式
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    
+    if img is None:
+        return None
+
+    # 黑白反轉邏輯 - 平均亮度 > 127 代表背景是白色,需反轉
+    if np.mean(img) > 127:
+        img = 255 - img
+    return img
+
+
+def _build_gel_densitometry(path, total_lanes):
+    # 備註:回傳物件只含各 Lane 的一維表 (稀疏表於接收端重建),不含原圖,跨程序傳遞量與影像寬度無關
+    img = read_gel_image(path)
+    if img is None:
+        return None
+    return GelDensitometry(img, total_lanes)
+
+
+@functools.lru_cache(maxsize=GEL_CACHE_SIZE)
+def _gel_densitometry_cached(path, mtime_ns, size, total_lanes):
+    # 解碼與建表在 worker pool 執行 (未啟動時於本程序執行)
+    return run_in_worker_pool(_build_gel_densitometry, path, total_lanes)
+
+
+def load_gel_densitometry(image_path, total_lanes=14):
+    """
+    取得電泳影像的密度分析物件 (每張影像只解碼與建表一次)
+    回傳:GelDensitometry,讀取失敗回傳 None
+    """
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+    return _gel_densitometry_cached(os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, total_lanes)
+
+
+# 備註:電泳預覽影像金字塔 - 每張影像只解碼一次,產生 1/2、1/4、1/8 縮圖
+# 介面只傳送縮圖,切換縮放比例時不需重新讀取原圖
+GEL_PREVIEW_SCALES = (2, 4, 8)
+GEL_PREVIEW_CHOICES = {"1/2": 2, "1/4": 4, "1/8": 8}
+_GEL_WINDOW_COLORS = {
+    "20k": (255, 99, 71),
+    "5k": (50, 205, 50),
+    "3k": (65, 105, 225),
+}
+_GEL_LANE_COLOR = (255, 215, 0)
+
+
+@functools.lru_cache(maxsize=GEL_CACHE_SIZE)
+def _gel_pyramid_cached(path, mtime_ns, size):
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    # 每層由上一層 pyrDown 而來 (高斯平滑後取半),只保留預覽需要的倍率
+    pyramid = {"shape": img.shape}
+    current, scale = img, 1
+    while scale < max(GEL_PREVIEW_SCALES) and min(current.shape) > 1:
+        current, scale = cv2.pyrDown(current), scale * 2
+        if scale in GEL_PREVIEW_SCALES:
+            pyramid[scale] = current
+    return pyramid
+
+
+def load_gel_pyramid(image_path):
+    """
+    取得電泳影像金字塔
+    回傳:dict - "shape" 為原圖大小,其餘鍵為縮小倍率 (2 / 4 / 8) 對應的灰階縮圖;讀取失敗回傳 None
+    """
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+    return _gel_pyramid_cached(os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=GEL_CACHE_SIZE * len(GEL_PREVIEW_SCALES))
+def _render_gel_preview_cached(pyramid_key, scale, total_lanes, measured_lanes):
+    pyramid = _gel_pyramid_cached(*pyramid_key)
+    if pyramid is None:
+        return None
+
+    full_h, full_w = pyramid["shape"]
+    small = pyramid.get(scale)
+    if small is None:
+        return None
+    h, w = small.shape
+    sx, sy = w / full_w, h / full_h
+    canvas = cv2.cvtColor(small, cv2.COLOR_GRAY2RGB)
+
+    # 標記區域:半透明色帶,位置與 analyze_gel_image 使用的列範圍相同
+    overlay = canvas.copy()
+    for name, (start, end) in GEL_BAND_WINDOWS.items():
+        y0, y1 = int(full_h * start) * sy, int(full_h * end) * sy
+        cv2.rectangle(overlay, (0, int(y0)), (w - 1, max(int(y1) - 1, int(y0))), _GEL_WINDOW_COLORS[name], -1)
+    canvas = cv2.addWeighted(overlay, 0.25, canvas, 0.75, 0)
+    for name, (start, _) in GEL_BAND_WINDOWS.items():
+        y0 = int(int(full_h * start) * sy)
+        cv2.putText(canvas, name, (2, y0 + 12), cv2.FONT_HERSHEY_SIMPLEX, 0.4, _GEL_WINDOW_COLORS[name], 1, cv2.LINE_AA)
+
+    # Lane 邊界與編號,實際有分析的 Lane 以粗框標示
+    lane_w = full_w // total_lanes
+    if lane_w > 0:
+        for lane in range(total_lanes):
+            x0 = int(lane * lane_w * sx)
+            x1 = int(min((lane + 1) * lane_w, full_w) * sx) - 1
+            measured = lane in measured_lanes
+            cv2.rectangle(canvas, (x0, 0), (max(x1, x0), h - 1), _GEL_LANE_COLOR, 2 if measured else 1)
+            cv2.putText(canvas, str(lane), (x0 + 2, h - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.35,
+                        _GEL_LANE_COLOR, 1, cv2.LINE_AA)
+
+    canvas.setflags(write=False)
+    return canvas
+
+
+def render_gel_preview(image_path, scale=4, total_lanes=14, measured_lanes=()):
+    """
+    產生電泳預覽圖 (縮圖 + Lane 邊界 + 20k/5k/3k 標記區域)
+    參數:
+        - scale: 縮小倍率 (GEL_PREVIEW_SCALES 之一)
+        - measured_lanes: 有樣本對應的 Lane 編號,以粗框標示
+    回傳:RGB 影像陣列,讀取失敗回傳 None
+    """
+    if image_path is None or scale not in GEL_PREVIEW_SCALES:
+        return None
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+    return _render_gel_preview_cached(key, scale, total_lanes, tuple(sorted(measured_lanes)))
+
+
 def analyze_gel_image(image_path, lane_index, total_lanes=14):
     """
     電泳影像分析函式
@@ -18,38 +367,22 @@ def analyze_gel_image(image_path, lane_index, total_lanes=14):
     if image_path is None:
         return "No Image", "N/A", "4"
     
-    # 備註:讀取影像為灰階格式
-    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    # 備註:同一張影像的各 Lane 列累積和與列最大值稀疏表只建立一次
+    gel = load_gel_densitometry(image_path, total_lanes)
     
-    if img is None:
+    if gel is None:
         return "Read Error", "N/A", "4"
 
-    # 黑白反轉邏輯 - 平均亮度 > 127 代表背景是白色,需反轉
-    if np.mean(img) > 127:
-        img = 255 - img
-
-    # 計算每條 Lane 的寬度並切割目標區域
-    h, w = img.shape
-    lane_w = w // total_lanes
-    start_x = lane_index * lane_w
-    lane_roi = img[:, start_x : start_x + lane_w]
-    
-    # 計算平均亮度用於判斷拖尾
-    avg_brightness = np.mean(lane_roi)
+    # 平均亮度用於判斷拖尾,三個標記區域取最大亮度
+    avg_brightness, bright_20k, bright_5k, bright_3k = gel.lane_statistics(lane_index)
     
     # 初步判斷是否有 Smearing(拖尾現象)
-    # ⚠️ 門檻值 50 可依樣本特性調整
-    if avg_brightness > 50:
+    # ⚠️ 門檻值見 GEL_THRESHOLDS["smear_brightness"]
+    if avg_brightness > GEL_THRESHOLDS["smear_brightness"]:
         smear_status = "Smearing"
     else:
         smear_status = "Clean"
 
-    # 偵測三個標記區域的亮度
-    # ⚠️ 這些比例 (0.15, 0.25 等) 需依實際 Ladder 位置調整
-    bright_20k = np.max(lane_roi[int(h*0.15):int(h*0.25), :])  # 20kb 區域
-    bright_5k  = np.max(lane_roi[int(h*0.45):int(h*0.55), :])  # 5kb 區域
-    bright_3k  = np.max(lane_roi[int(h*0.65):int(h*0.75), :])  # 3kb 區域
-    
     # 複雜的 Smearing 狀態判定邏輯
     # 這部分根據各區域亮度關係來細化拖尾判斷
     if smear_status == "Smearing":
@@ -81,12 +414,12 @@ def analyze_gel_image(image_path, lane_index, total_lanes=14):
         status = ""
         integrity_score = "Low"
         
-        # 亮度 > 100 視為可見條帶
-        # 門檻值 100 可依需求調整
-        if bright_20k > 100:
+        # 亮度 > band_brightness 視為可見條帶
+        band_threshold = GEL_THRESHOLDS["band_brightness"]
+        if bright_20k > band_threshold:
             status = "band integrity"
             integrity_score = "Visible"
-        elif bright_5k > 100 or bright_3k > 100:
+        elif bright_5k > band_threshold or bright_3k > band_threshold:
             status = "band accptable"
             integrity_score = "Medium"
         else:
@@ -108,321 +441,2681 @@ def analyze_gel_image(image_path, lane_index, total_lanes=14):
     else:
         n_result = "4"
 
-    return smear_status, integrity_score, n_result
+    return smear_status, integrity_score, n_result
+
+
+# --- 2. Stunner Data Loading with Color Annotation ---
+
+# header=23 代表從第 24 行開始讀取數據
+# 若 Stunner 儀器格式變更,需調整此數字
+STUNNER_HEADER_ROW = 23
+
+# 備註:Stunner 品質判定門檻
+#   - 濃度 < min_concentration 或比值超出範圍 → FAIL
+#   - 三項皆達 pass_* 標準 → PASS,其餘 → ACCEPTABLE
+QC_THRESHOLDS = {
+    "min_concentration": 20.0,
+    "ratio_280_low": 1.8,
+    "ratio_280_high": 2.0,
+    "ratio_230_low": 2.0,
+    "pass_concentration": 50.0,
+    "pass_ratio_280": 1.9,
+    "pass_ratio_230": 2.2,
+}
+
+# 備註:xlsx 為 zip 容器,舊版 xls 為 OLE2 容器
+_EXCEL_MAGIC = (b"PK\x03\x04", b"\xd0\xcf\x11\xe0")
+_EXCEL_EXTS = (".xlsx", ".xlsm", ".xls")
+_DELIMITED_SEPS = {"csv": ",", "tsv": "\t"}
+
+
+def detect_stunner_format(path):
+    """
+    判斷 Stunner 匯出檔格式
+    功能:先看副檔名,副檔名不明時再讀檔頭判斷
+    回傳:"excel" / "csv" / "tsv"
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in _EXCEL_EXTS:
+        return "excel"
+    if ext == ".csv":
+        return "csv"
+    if ext in (".tsv", ".tab"):
+        return "tsv"
+
+    with open(path, "rb") as fh:
+        head = fh.read(4096)
+    if head.startswith(_EXCEL_MAGIC):
+        return "excel"
+    return "tsv" if head.count(b"\t") > head.count(b",") else "csv"
+
+
+def _read_delimited(path, sep):
+    """
+    讀取 CSV / TSV 匯出檔
+    功能:優先使用 pyarrow 引擎,未安裝或格式不支援時退回 C 引擎
+    """
+    # 備註:skiprows 直接略過儀器資訊行,這些行的欄位數與數據區不同
+    try:
+        return pd.read_csv(path, sep=sep, skiprows=STUNNER_HEADER_ROW, engine="pyarrow")
+    except (ImportError, ValueError):
+        return pd.read_csv(path, sep=sep, skiprows=STUNNER_HEADER_ROW, engine="c")
+
+
+@functools.lru_cache(maxsize=32)
+def _read_plates_cached(path, mtime_ns, size):
+    """
+    實際解析檔案 (依路徑、修改時間與大小快取)
+    功能:解析在 worker pool 執行 (未啟動時於本程序執行)
+    回傳:((plate_label, DataFrame), ...)
+    """
+    return run_in_worker_pool(_parse_plates, path)
+
+
+def _parse_plates(path):
+    """解析 Stunner 匯出檔,回傳 ((plate_label, DataFrame), ...)"""
+    base_name = os.path.basename(path)
+    file_format = detect_stunner_format(path)
+
+    if file_format != "excel":
+        df = _read_delimited(path, _DELIMITED_SEPS[file_format])
+        return ((base_name, df),)
+
+    # 備註:整本活頁簿只開啟一次,每個工作表各自成為一個 plate
+    plates = []
+    with pd.ExcelFile(path) as workbook:
+        sheet_names = workbook.sheet_names
+        for sheet in sheet_names:
+            try:
+                df = workbook.parse(sheet, header=STUNNER_HEADER_ROW)
+            except ValueError:
+                # 工作表行數不足 (例如說明頁),略過
+                continue
+            if df.empty:
+                continue
+            label = base_name if len(sheet_names) == 1 else f"{base_name} [{sheet}]"
+            plates.append((label, df))
+
+    if not plates:
+        raise ValueError(f"No Stunner data found in {base_name}")
+    return tuple(plates)
+
+
+def read_stunner_plates(path):
+    """
+    讀取 Stunner 匯出檔的所有 plate
+    功能:自動判斷 Excel / CSV / TSV,多工作表活頁簿一次解析
+    回傳:[(plate_label, DataFrame), ...],DataFrame 為副本可直接修改
+    """
+    stat = os.stat(path)
+    plates = _read_plates_cached(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    return [(label, df.copy()) for label, df in plates]
+
+
+def list_stunner_plates(file_objs):
+    """
+    將多個上傳檔案展開為 plate 清單
+    回傳:[(plate_label, DataFrame), ...]
+    """
+    plates = []
+    for f in file_objs:
+        plates.extend(read_stunner_plates(_upload_path(f)))
+    return plates
+
+
+def iter_source_plates(file_objs):
+    """
+    逐一取出每個上傳檔案的 plate,並附上檔案內容識別 (SHA-256)
+    回傳:generator of (source_sha256, plate_label, DataFrame)
+    """
+    for f in file_objs:
+        path = _upload_path(f)
+        source = upload_identity(path)
+        for label, df in read_stunner_plates(path):
+            yield source, label, df
+
+
+def measured_gel_lanes(file_objs, total_lanes=14):
+    """
+    計算上傳檔案會用到的電泳 Lane (第 i 個樣本對應第 i+1 條 Lane,每個 plate 各自從 Lane 1 起算)
+    回傳:Lane 編號 tuple,供電泳預覽標示
+    """
+    if not file_objs:
+        return ()
+    try:
+        rows = max((len(df) for _, df in list_stunner_plates(file_objs)), default=0)
+    except Exception:
+        return ()
+    return tuple(range(1, min(rows + 1, total_lanes)))
+
+
+def load_single_stunner(file_obj, profile=None):
+    """
+    載入單一 Stunner 檔案並標註品質
+    功能:讀取 Stunner 儀器導出的 Excel / CSV 並自動判定品質狀態
+    參數:
+        - profile: QC profile 名稱,None 時使用預設 profile
+    """
+    if file_obj is None:
+        return None, "Please select a file"
+
+    try:
+        plates = read_stunner_plates(_upload_path(file_obj))
+        if len(plates) == 1:
+            df = plates[0][1]
+        else:
+            # 多工作表時合併顯示,並以 Plate 欄位標示來源工作表
+            df = pd.concat(
+                [plate_df.assign(Plate=label) for label, plate_df in plates],
+                ignore_index=True
+            )
+
+        # 依 QC profile 向量化判定品質
+        _apply_quality_check(df, get_qc_profile(profile))
+        
+        # 套用顏色樣式
+        styled_df = style_dataframe(df)
+        success_msg = f"Successfully loaded {len(df)} samples"
+        if len(plates) > 1:
+            success_msg += f" from {len(plates)} plates"
+        return styled_df, success_msg
+    
+    except Exception as e:
+        error_msg = f"Loading failed: {str(e)}"
+        return None, error_msg
+
+
+# 品質判定對應顏色 (介面表格與 Excel 匯出共用)
+QUALITY_COLORS = {
+    'PASS': '#90EE90',
+    'ACCEPTABLE': '#87CEEB',
+    'FAIL': '#FFB6C6',
+    'ERROR': '#D3D3D3',
+}
+
+
+def style_dataframe(df):
+    """
+    表格顏色標註函式
+    功能:根據品質判定結果上色,方便快速辨識
+    """
+    def color_rows(row):
+        if 'Quality Check' not in row.index:
+            return [''] * len(row)
+        
+        color = QUALITY_COLORS.get(row['Quality Check'])
+        if color is None:
+            return [''] * len(row)
+        return [f'background-color: {color}'] * len(row)
+    
+    return df.style.apply(color_rows, axis=1)
+
+
+# --- 2.1 Excel Export Formatting ---
+
+# 備註:數值欄位格式,比值取 3 位小數,分析產生的濃度欄取 2 位
+# 其他浮點欄位 (Stunner 原始儀器數值) 維持 Excel 通用格式,顯示位數與儀器匯出一致
+_EXCEL_RATIO_FORMAT = "0.000"
+_EXCEL_FLOAT_FORMAT = "0.00"
+_EXCEL_INT_FORMAT = "0"
+_EXCEL_MAX_COLUMN_WIDTH = 40
+
+
+def _excel_number_format(column_name, dtype, raw=False):
+    """
+    依欄位名稱與型別決定 Excel 數值格式,非數值欄位或維持通用格式時回傳 None
+    raw=True 時為 Stunner 原始表格,浮點欄位一律維持通用格式
+    """
+    if pd.api.types.is_bool_dtype(dtype) or not pd.api.types.is_numeric_dtype(dtype):
+        return None
+    if pd.api.types.is_integer_dtype(dtype):
+        return _EXCEL_INT_FORMAT
+    if raw:
+        return None
+    if "260/" in str(column_name):
+        return _EXCEL_RATIO_FORMAT
+    if column_name == "Concentration":
+        return _EXCEL_FLOAT_FORMAT
+    return None
+
+
+def format_excel_block(ws, df, header_row, raw=False):
+    """
+    設定一個表格區塊的欄寬與數值格式
+    參數:
+        - ws: openpyxl 工作表
+        - df: 寫入該區塊的 DataFrame (index=False)
+        - header_row: 標題列的列號 (從 1 開始)
+        - raw: True 為 Stunner 原始表格,浮點欄位不套用小數位數
+    """
+    first_row = header_row + 1
+    last_row = header_row + len(df)
+
+    for col_idx, column_name in enumerate(df.columns, start=1):
+        letter = get_column_letter(col_idx)
+
+        # 欄寬取標題與內容最長者,不逐格量測樣式
+        content_width = 0
+        if len(df):
+            content_width = int(df[column_name].astype(str).str.len().max())
+        width = min(max(len(str(column_name)), content_width) + 2, _EXCEL_MAX_COLUMN_WIDTH)
+        current = ws.column_dimensions[letter].width or 0
+        ws.column_dimensions[letter].width = max(current, width)
+
+        number_format = _excel_number_format(column_name, df[column_name].dtype, raw)
+        if number_format is None or last_row < first_row:
+            continue
+        # 相同格式共用同一個樣式索引,檔案大小不隨列數增加樣式定義
+        for (cell,) in ws.iter_rows(min_row=first_row, max_row=last_row,
+                                    min_col=col_idx, max_col=col_idx):
+            cell.number_format = number_format
+
+
+def add_quality_rules(ws, df, header_row):
+    """
+    以工作表層級的條件式格式標示品質顏色
+    功能:依 Quality Check 欄位整列上色,取代逐格樣式,每種狀態只有一條規則
+    """
+    if 'Quality Check' not in df.columns or len(df) == 0:
+        return
+
+    qc_letter = get_column_letter(df.columns.get_loc('Quality Check') + 1)
+    first_row = header_row + 1
+    last_row = header_row + len(df)
+    cell_range = f"A{first_row}:{get_column_letter(len(df.columns))}{last_row}"
+
+    for quality, color in QUALITY_COLORS.items():
+        fill = PatternFill(start_color=color.lstrip('#'), end_color=color.lstrip('#'), fill_type='solid')
+        ws.conditional_formatting.add(
+            cell_range,
+            FormulaRule(formula=[f'${qc_letter}{first_row}="{quality}"'], fill=fill)
+        )
+
+
+def write_quality_export(df, save_path):
+    """
+    匯出含品質判定的 Stunner 表格
+    功能:凍結標題列、設定數值格式,並以條件式格式保留 PASS/ACCEPTABLE/FAIL/ERROR 顏色
+    """
+    with pd.ExcelWriter(save_path, engine='openpyxl') as writer:
+        df.to_excel(writer, sheet_name='Stunner Result', index=False)
+        ws = writer.sheets['Stunner Result']
+        ws.freeze_panes = 'A2'
+        format_excel_block(ws, df, header_row=1, raw=True)
+        add_quality_rules(ws, df, header_row=1)
+
+    return save_path
+
+
+def load_multi_stunner(file_objs, selected_file_index, profile=None):
+    """
+    載入多個 Stunner 檔案並支援切換瀏覽
+    功能:處理多檔案上傳,允許使用者切換查看不同檔案
+    參數:
+        - profile: QC profile 名稱,None 時使用預設 profile
+    """
+    if not file_objs:
+        return None, None, "Please upload files", []
+    
+    try:
+        plates = list_stunner_plates(file_objs)
+    except Exception as e:
+        return None, None, f"Error loading file: {str(e)}", []
+    
+    plate_names = [label for label, _ in plates]
+    
+    if selected_file_index is None:
+        selected_file_index = 0
+    
+    if selected_file_index >= len(plates):
+        selected_file_index = 0
+    
+    try:
+        df = plates[selected_file_index][1]
+        
+        _apply_quality_check(df, get_qc_profile(profile))
+        
+        styled_df = style_dataframe(df)
+        file_info = f"Viewing plate {selected_file_index + 1} of {len(plates)}: {plate_names[selected_file_index]}"
+        
+        return styled_df, None, file_info, plate_names
+        
+    except Exception as e:
+        error_msg = f"Error loading file: {str(e)}"
+        return None, None, error_msg, plate_names
+
+
+# --- 2.2 QC Rule Profiles ---
+
+# 備註:QC 與濃度分級規則由設定檔載入,不同實驗室 / 樣本類型可切換 profile
+# 環境變數 QC_PROFILE_PATH 可指定其他設定檔,QC_PROFILE 可指定預設 profile
+QC_PROFILE_PATH = os.environ.get(
+    "QC_PROFILE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "qc_profiles.json")
+)
+QC_PROFILE_VERSIONS = (1,)
+
+# 濃度分級預設門檻:>= high 為 High,>= medium 為 Medium,其餘為 Low
+CONCENTRATION_LEVEL_THRESHOLDS = {"high": 50.0, "medium": 20.0}
+
+# 找不到設定檔時使用的內建 profile
+_BUILTIN_QC_PROFILES = {
+    "version": 1,
+    "default_profile": "DNA",
+    "profiles": {
+        "DNA": {
+            "revision": 0,
+            "description": "Built-in DNA thresholds",
+            "qc": QC_THRESHOLDS,
+            "concentration_levels": CONCENTRATION_LEVEL_THRESHOLDS,
+        },
+    },
+}
+
+# 問題項目依位元順序排列,Note 依位元組合預先建表
+_QC_ISSUES = ("Low concentration", "260/280 too low", "260/280 too high", "260/230 abnormal")
+
+
+def _qc_issue_bits(con, ratio_280_260, ratio_260_230, thresholds):
+    """
+    計算每個樣本的問題位元 (支援廣播)
+    回傳:整數陣列,0 表示沒有問題,各位元對應 _QC_ISSUES
+    """
+    t = thresholds
+    return (
+        (con < t["min_concentration"]).astype(np.int8)
+        | ((ratio_280_260 < t["ratio_280_low"]).astype(np.int8) << 1)
+        | ((ratio_280_260 > t["ratio_280_high"]).astype(np.int8) << 2)
+        | ((ratio_260_230 < t["ratio_230_low"]).astype(np.int8) << 3)
+    )
+
+
+class QCProfile:
+    """
+    編譯後的 QC profile
+    功能:門檻在建立時驗證並固定,Note 文字依問題組合預先建表,判定時只做陣列運算
+    """
+
+    def __init__(self, name, spec):
+        self.name = name
+        self.revision = spec.get("revision", 0)
+        self.description = spec.get("description", "")
+
+        qc = spec.get("qc", {})
+        missing = [key for key in QC_THRESHOLDS if key not in qc]
+        if missing:
+            raise ValueError(f"QC profile {name} is missing: {', '.join(missing)}")
+        self.thresholds = {key: float(qc[key]) for key in QC_THRESHOLDS}
+
+        levels = {**CONCENTRATION_LEVEL_THRESHOLDS, **spec.get("concentration_levels", {})}
+        self.level_high = float(levels["high"])
+        self.level_medium = float(levels["medium"])
+        if self.level_medium > self.level_high:
+            raise ValueError(f"QC profile {name}: medium level is above high level")
+
+        # Note 類別:位元組合 1~15,之後為 PASS / ACCEPTABLE / ERROR 的說明
+        combos = [
+            "; ".join(issue for bit, issue in enumerate(_QC_ISSUES) if mask & (1 << bit))
+            for mask in range(1, 1 << len(_QC_ISSUES))
+        ]
+        self.note_dtype = pd.CategoricalDtype(
+            combos + ["Excellent quality", "Meets minimum standard", "Cannot read values"]
+        )
+        self._pass_note = len(combos)
+        self._acceptable_note = len(combos) + 1
+        self._error_note = len(combos) + 2
+
+    def evaluate(self, con, ratio_280_260, ratio_260_230, raw_ok):
+        """
+        品質判定
+        回傳:(Quality Check, Note),皆為 Categorical
+        """
+        t = self.thresholds
+        bits = _qc_issue_bits(con, ratio_280_260, ratio_260_230, t)
+        fail = bits != 0
+        passed = (
+            ~fail
+            & (con >= t["pass_concentration"])
+            & (ratio_280_260 >= t["pass_ratio_280"])
+            & (ratio_260_230 >= t["pass_ratio_230"])
+        )
+
+        categories = list(QUALITY_CHECK_DTYPE.categories)
+        quality_codes = np.select(
+            [~raw_ok, fail, passed],
+            [categories.index("ERROR"), categories.index("FAIL"), categories.index("PASS")],
+            categories.index("ACCEPTABLE")
+        )
+        note_codes = np.select(
+            [~raw_ok, fail, passed],
+            [self._error_note, bits.astype(np.int16) - 1, self._pass_note],
+            self._acceptable_note
+        )
+        return (
+            pd.Categorical.from_codes(quality_codes, dtype=QUALITY_CHECK_DTYPE),
+            pd.Categorical.from_codes(note_codes, dtype=self.note_dtype),
+        )
+
+    def concentration_level(self, con):
+        """濃度分級 (High / Medium / Low)"""
+        return np.select(
+            [con >= self.level_high, con >= self.level_medium],
+            ["High", "Medium"],
+            "Low"
+        ).astype(object)
+
+    def needs_gel(self, con):
+        """濃度達標才進行電泳分析"""
+        return con >= self.thresholds["min_concentration"]
+
+
+@functools.lru_cache(maxsize=4)
+def _compiled_qc_profiles(path, mtime_ns):
+    """
+    載入並編譯設定檔中的所有 profile (依路徑與修改時間快取)
+    回傳:({profile 名稱: QCProfile}, 預設 profile 名稱)
+    """
+    if mtime_ns is None:
+        spec = _BUILTIN_QC_PROFILES
+    else:
+        with open(path, encoding="utf-8") as fh:
+            spec = json.load(fh)
+
+    version = spec.get("version")
+    if version not in QC_PROFILE_VERSIONS:
+        raise ValueError(f"Unsupported QC profile file version: {version}")
+
+    profiles = {name: QCProfile(name, body) for name, body in spec.get("profiles", {}).items()}
+    if not profiles:
+        raise ValueError("QC profile file defines no profiles")
+
+    default = spec.get("default_profile") or next(iter(profiles))
+    if default not in profiles:
+        raise ValueError(f"Default QC profile {default} is not defined")
+    return profiles, default
+
+
+def _qc_profile_table():
+    try:
+        mtime_ns = os.stat(QC_PROFILE_PATH).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    return _compiled_qc_profiles(QC_PROFILE_PATH, mtime_ns)
+
+
+def qc_profile_names():
+    """可選用的 QC profile 名稱"""
+    return list(_qc_profile_table()[0])
+
+
+def get_qc_profile(name=None):
+    """
+    取得編譯後的 QC profile
+    參數:
+        - name: profile 名稱或 QCProfile;None 時依序使用環境變數 QC_PROFILE、設定檔預設值
+    """
+    if isinstance(name, QCProfile):
+        return name
+    profiles, default = _qc_profile_table()
+    name = name or os.environ.get("QC_PROFILE") or default
+    if name not in profiles:
+        raise ValueError(f"Unknown QC profile: {name}")
+    return profiles[name]
+
+
+def _extract_measurements(df_raw):
+    """
+    取出濃度與比值欄位
+    回傳:(con, ratio_280_260, ratio_260_230, raw_ok)
+    """
+    n = len(df_raw)
+    # ⚠️ iloc[:, 9]  → 濃度 (Concentration)
+    # ⚠️ iloc[:, 11] → 260/280 Ratio
+    # ⚠️ iloc[:, 12] → 260/230 Ratio
+    if df_raw.shape[1] <= 12:
+        zeros = np.zeros(n)
+        return zeros, zeros, zeros, np.zeros(n, dtype=bool)
+
+    con, con_ok = _coerce_float(df_raw.iloc[:, 9])
+    ratio_280_260, r280_ok = _coerce_float(df_raw.iloc[:, 11])
+    ratio_260_230, r230_ok = _coerce_float(df_raw.iloc[:, 12])
+    return con, ratio_280_260, ratio_260_230, con_ok & r280_ok & r230_ok
+
+
+def _apply_quality_check(df, profile):
+    """在 Stunner 表格加上 Quality Check 與 Note 欄位"""
+    con, ratio_280_260, ratio_260_230, raw_ok = _extract_measurements(df)
+    quality, note = profile.evaluate(con, ratio_280_260, ratio_260_230, raw_ok)
+    df['Quality Check'] = quality
+    df['Note'] = note
+    return df
+
+
+# 備註:啟動時即載入並編譯預設 profile,設定檔有誤時立即發現
+get_qc_profile()
+
+
+# --- 2.3 Upload Intake ---
+
+# 備註:上傳檔案先經過 intake 才交給 pandas / cv2 解析
+# 邊串流複製邊計算 SHA-256,存到以雜湊命名的資料夾 (intake/<sha256>/<原檔名>),
+# 相同內容重複上傳會得到相同路徑,後續的解析快取與增量分析都以此為鍵
+# 超過大小 / 列數 / 像素上限或內容不是活頁簿 / 影像時,在解析前就拒絕
+# ⚠️ 上限皆可由環境變數調整 (MB / 列數 / 百萬像素)
+# ⚠️ intake 保留最近 INTAKE_KEEP 個上傳內容,且總大小不超過 INTAKE_MAX_MB (先刪最久未使用者)
+ANALYSIS_DATA_DIR = os.environ.get("ANALYSIS_DATA_DIR", "analysis_data")
+INTAKE_DIR = os.path.join(ANALYSIS_DATA_DIR, "intake")
+INTAKE_KEEP = int(os.environ.get("ANALYSIS_INTAKE_KEEP", "200"))
+INTAKE_MAX_MB = float(os.environ.get("ANALYSIS_INTAKE_MAX_MB", "2048"))
+UPLOAD_LIMITS = {
+    "file_mb": float(os.environ.get("ANALYSIS_MAX_FILE_MB", "50")),
+    "batch_mb": float(os.environ.get("ANALYSIS_MAX_BATCH_MB", "500")),
+    "batch_files": int(os.environ.get("ANALYSIS_MAX_FILES", "100")),
+    "rows": int(os.environ.get("ANALYSIS_MAX_ROWS", "20000")),
+    "workbook_expand": float(os.environ.get("ANALYSIS_MAX_WORKBOOK_EXPANSION", "20")),
+    "gel_megapixels": float(os.environ.get("ANALYSIS_MAX_GEL_MEGAPIXELS", "50")),
+}
+_INTAKE_CHUNK = 1024 * 1024
+_IMAGE_MAGIC = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpeg",
+    b"II*\x00": "tiff",
+    b"MM\x00*": "tiff",
+    b"BM": "bmp",
+}
+_XLSX_DIMENSION = re.compile(rb'<dimension ref="[A-Z]+\d+(?::[A-Z]+(\d+))?"')
+
+_intake_index = collections.OrderedDict()
+_intake_lock = threading.Lock()
+
+
+class UploadRejected(ValueError):
+    """上傳檔案不符合大小、列數或格式限制"""
+
+
+def _mb(size):
+    return size / (1024 * 1024)
+
+
+def _check_stunner_head(name, head):
+    """依副檔名與檔頭判斷是否為活頁簿或文字檔 (CSV / TSV)"""
+    ext = os.path.splitext(name)[1].lower()
+    if ext in _EXCEL_EXTS or head.startswith(_EXCEL_MAGIC):
+        if not head.startswith(_EXCEL_MAGIC):
+            raise UploadRejected(f"{name} is not a valid Excel workbook")
+        return
+    if b"\x00" in head:
+        raise UploadRejected(f"{name} is neither an Excel workbook nor a text export")
+
+
+def _tiff_dimensions(fh):
+    """由第一個 IFD 的 ImageWidth (256) / ImageLength (257) 標籤讀取 TIFF 寬高"""
+    header = fh.read(8)
+    order = "little" if header[:2] == b"II" else "big"
+    fh.seek(int.from_bytes(header[4:8], order))
+    count = int.from_bytes(fh.read(2), order)
+    size = {}
+    for _ in range(min(count, 4096)):
+        entry = fh.read(12)
+        if len(entry) < 12:
+            break
+        tag = int.from_bytes(entry[0:2], order)
+        field_type = int.from_bytes(entry[2:4], order)
+        if tag in (256, 257) and field_type in (3, 4):
+            # SHORT 佔 2 bytes,LONG 佔 4 bytes,皆存放在 entry 的值欄位
+            size[tag] = int.from_bytes(entry[8:10] if field_type == 3 else entry[8:12], order)
+    if 256 in size and 257 in size:
+        return size[256], size[257]
+    return None
+
+
+def _image_dimensions(kind, fh):
+    """
+    由檔頭讀取影像寬高 (PNG / JPEG / TIFF / BMP),不解碼像素
+    參數:
+        - fh: 可 seek 的二進位檔案物件
+    回傳:(寬, 高),無法判斷時回傳 None
+    """
+    fh.seek(0)
+    if kind == "tiff":
+        return _tiff_dimensions(fh)
+    head = fh.read(26)
+    if kind == "png" and len(head) >= 24:
+        return int.from_bytes(head[16:20], "big"), int.from_bytes(head[20:24], "big")
+    if kind == "bmp" and len(head) >= 26:
+        return abs(int.from_bytes(head[18:22], "little", signed=True)), abs(int.from_bytes(head[22:26], "little", signed=True))
+    if kind == "jpeg":
+        # 依序略過各區段,直到 SOF 標記 (記錄影像大小);EXIF 縮圖等大區段以 seek 略過
+        pos = 2
+        while True:
+            fh.seek(pos)
+            segment = fh.read(9)
+            if len(segment) < 9 or segment[0] != 0xFF:
+                return None
+            marker = segment[1]
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                return int.from_bytes(segment[7:9], "big"), int.from_bytes(segment[5:7], "big")
+            pos += 2 + int.from_bytes(segment[2:4], "big")
+    return None
+
+
+def _check_gel_head(name, fh):
+    """
+    確認為支援的影像格式,並在解碼前檢查像素數
+    備註:讀不到寬高的影像一律拒絕,避免壓縮影像解碼後超過記憶體
+    """
+    fh.seek(0)
+    head = fh.read(16)
+    kind = next((k for magic, k in _IMAGE_MAGIC.items() if head.startswith(magic)), None)
+    if kind is None:
+        raise UploadRejected(f"{name} is not a PNG, JPEG, TIFF or BMP image")
+    size = _image_dimensions(kind, fh)
+    fh.seek(0)
+    if size is None:
+        raise UploadRejected(f"Could not determine the image size of {name}")
+    if size[0] * size[1] > UPLOAD_LIMITS["gel_megapixels"] * 1e6:
+        raise UploadRejected(
+            f"{name} is {size[0]}x{size[1]} pixels "
+            f"(limit {UPLOAD_LIMITS['gel_megapixels']:g} megapixels)"
+        )
+
+
+def _check_workbook_rows(name, path):
+    """
+    不解析儲存格,只檢查 xlsx 的壓縮後展開大小與各工作表宣告的範圍 (<dimension>)
+    舊版 .xls 沒有這些資訊,只受檔案大小限制
+    """
+    try:
+        workbook = zipfile.ZipFile(path)
+    except zipfile.BadZipFile:
+        raise UploadRejected(f"{name} is not a valid Excel workbook")
+    with workbook:
+        members = workbook.infolist()
+        expanded = sum(info.file_size for info in members)
+        if expanded > os.path.getsize(path) * UPLOAD_LIMITS["workbook_expand"] + 10 * _INTAKE_CHUNK:
+            raise UploadRejected(f"{name} expands to {_mb(expanded):.0f} MB when opened")
+        for info in members:
+            if not (info.filename.startswith("xl/worksheets/") and info.filename.endswith(".xml")):
+                continue
+            with workbook.open(info) as sheet:
+                match = _XLSX_DIMENSION.search(sheet.read(4096))
+            if match and match.group(1) and int(match.group(1)) > UPLOAD_LIMITS["rows"] + STUNNER_HEADER_ROW + 1:
+                raise UploadRejected(
+                    f"{name} has {int(match.group(1))} rows in one sheet "
+                    f"(limit {UPLOAD_LIMITS['rows']} samples)"
+                )
+
+
+def _intake_entry_size(path):
+    total = 0
+    try:
+        for item in os.scandir(path):
+            if item.is_file(follow_symlinks=False):
+                total += item.stat().st_size
+    except OSError:
+        pass
+    return total
+
+
+def _prune_intake():
+    """
+    只保留最近使用的上傳內容
+    功能:由最久未使用者開始刪除,直到數量不超過 INTAKE_KEEP 且總大小不超過 INTAKE_MAX_MB;
+         最近一次的上傳一定保留
+    """
+    try:
+        entries = sorted(
+            (entry for entry in os.scandir(INTAKE_DIR) if entry.is_dir(follow_symlinks=False)),
+            key=lambda entry: entry.stat().st_mtime_ns
+        )
+    except OSError:
+        return
+    sizes = [_intake_entry_size(entry.path) for entry in entries]
+    count, total = len(entries), sum(sizes)
+    for entry, size in zip(entries[:-1], sizes):
+        if count <= INTAKE_KEEP and _mb(total) <= INTAKE_MAX_MB:
+            break
+        shutil.rmtree(entry.path, ignore_errors=True)
+        count -= 1
+        total -= size
+
+
+def _stream_intake(source, name, kind):
+    """邊讀邊檢查、計算雜湊並複製到暫存檔,完成後移到內容定址路徑"""
+    os.makedirs(INTAKE_DIR, exist_ok=True)
+    hasher = hashlib.sha256()
+    lines = 0
+    fd, tmp_path = tempfile.mkstemp(dir=INTAKE_DIR, prefix=".upload_")
+    try:
+        with open(source, "rb") as src, os.fdopen(fd, "wb") as dst:
+            if kind == "gel":
+                _check_gel_head(name, src)
+            head = src.read(64 * 1024)
+            if kind != "gel":
+                _check_stunner_head(name, head)
+            text = kind == "stunner" and not head.startswith(_EXCEL_MAGIC)
+            
+            chunk = head
+            while chunk:
+                hasher.update(chunk)
+                dst.write(chunk)
+                if text:
+                    lines += chunk.count(b"\n")
+                    if lines > UPLOAD_LIMITS["rows"] + STUNNER_HEADER_ROW + 1:
+                        raise UploadRejected(f"{name} has more than {UPLOAD_LIMITS['rows']} sample rows")
+                chunk = src.read(_INTAKE_CHUNK)
+        
+        if kind == "stunner" and not text and head.startswith(_EXCEL_MAGIC[0]):
+            _check_workbook_rows(name, tmp_path)
+        
+        target_dir = os.path.join(INTAKE_DIR, hasher.hexdigest())
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, name)
+        if os.path.exists(target):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, target)
+        os.utime(target_dir)
+        return target
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def intake_upload(file_obj, kind="stunner"):
+    """
+    上傳檔案 intake
+    參數:
+        - kind: "stunner" (Excel / CSV / TSV) 或 "gel" (影像)
+    回傳:內容定址的檔案路徑;file_obj 為 None 時回傳 None
+    例外:UploadRejected - 超過限制或格式不符
+    """
+    source = _upload_path(file_obj)
+    if source is None:
+        return None
+    try:
+        stat = os.stat(source)
+    except OSError:
+        raise UploadRejected(f"{os.path.basename(source)} could not be read")
+    name = os.path.basename(source)
+    if _mb(stat.st_size) > UPLOAD_LIMITS["file_mb"]:
+        raise UploadRejected(
+            f"{name} is {_mb(stat.st_size):.1f} MB (limit {UPLOAD_LIMITS['file_mb']:g} MB)"
+        )
+    
+    # 同一個上傳檔 (路徑、修改時間、大小相同) 只處理一次
+    key = (os.path.abspath(source), stat.st_mtime_ns, stat.st_size, kind)
+    with _intake_lock:
+        target = _intake_index.get(key)
+    if target is not None and os.path.exists(target):
+        return target
+    
+    target = _stream_intake(source, name, kind)
+    with _intake_lock:
+        _intake_index[key] = target
+        while len(_intake_index) > INTAKE_KEEP:
+            _intake_index.popitem(last=False)
+        _prune_intake()
+    return target
+
+
+def intake_uploads(file_objs, kind="stunner"):
+    """
+    多檔 intake:先檢查檔案數與總大小,再逐一處理
+    回傳:內容定址路徑 list
+    """
+    if not file_objs:
+        return []
+    if not isinstance(file_objs, (list, tuple)):
+        file_objs = [file_objs]
+    if len(file_objs) > UPLOAD_LIMITS["batch_files"]:
+        raise UploadRejected(f"{len(file_objs)} files uploaded (limit {UPLOAD_LIMITS['batch_files']})")
+    
+    total = 0
+    for f in file_objs:
+        try:
+            total += os.path.getsize(_upload_path(f))
+        except OSError:
+            pass
+    if _mb(total) > UPLOAD_LIMITS["batch_mb"]:
+        raise UploadRejected(f"Upload batch is {_mb(total):.1f} MB (limit {UPLOAD_LIMITS['batch_mb']:g} MB)")
+    
+    return [intake_upload(f, kind) for f in file_objs]
+
+
+@functools.lru_cache(maxsize=256)
+def _file_sha256(path, mtime_ns, size):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(_INTAKE_CHUNK), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def upload_identity(path):
+    """
+    檔案內容的 SHA-256
+    功能:intake 路徑直接取內容定址資料夾名稱;其他路徑 (例如 --export) 讀檔計算並快取
+    """
+    path = os.path.abspath(path)
+    parent = os.path.dirname(path)
+    if os.path.dirname(parent) == os.path.abspath(INTAKE_DIR):
+        return os.path.basename(parent)
+    stat = os.stat(path)
+    return _file_sha256(path, stat.st_mtime_ns, stat.st_size)
+
+
+# --- 3. Master Analysis System with Separated Raw Data ---
+
+# 備註:分析表欄位型別
+# 列舉欄位用 category 儲存,比值用 float32,Order 用 int8,大批次常駐記憶體時可大幅縮小
+# 濃度等級為有序類別,由低到高排列,排序時依等級而非字母順序
+CONCENTRATION_LEVEL_DTYPE = pd.CategoricalDtype(["Error", "Low", "Medium", "High"], ordered=True)
+QUALITY_CHECK_DTYPE = pd.CategoricalDtype(["ACCEPTABLE", "ERROR", "FAIL", "PASS"])
+RATIO_DTYPE = np.float32
+ORDER_DTYPE = np.int8
+
+
+def _coerce_float(values):
+    """
+    將欄位逐格轉為浮點數 (與 float() 行為一致)
+    功能:空值轉為 NaN 仍視為可讀,無法解析的字串才標記為失敗
+    回傳:(float64 陣列, 可解析遮罩)
+    """
+    numeric = pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+    ok = ~np.isnan(numeric) | pd.isna(values).to_numpy()
+
+    # to_numeric 不接受但 float() 可以的寫法 (例如前後空白) 逐格補救
+    for i in np.flatnonzero(~ok):
+        try:
+            numeric[i] = float(values.iloc[i])
+            ok[i] = True
+        except (TypeError, ValueError):
+            pass
+
+    return numeric, ok
+
+
+def _analyze_plate(df_raw, gel_image, profile, lanes=None):
+    """
+    分析單一 plate
+    功能:以欄位為單位計算濃度分級與電泳結果
+    參數:
+        - lanes: 每列對應的電泳 Lane,預設第 i 個樣本對應第 i+1 條 Lane
+    回傳:dict,每個欄位為長度等於樣本數的陣列
+        - raw_ok: 數值可解析 (會列入 raw data)
+        - error: 數值無法解析或電泳分析失敗 (分析表以 Error 列呈現)
+    """
+    n = len(df_raw)
+    if lanes is None:
+        lanes = np.arange(1, n + 1)
+    samples = df_raw.iloc[:, 1].astype(str).to_numpy(dtype=object)
+    con, ratio_280_260, ratio_260_230, raw_ok = _extract_measurements(df_raw)
+
+    # 濃度分級
+    con_level = profile.concentration_level(con)
+
+    # 電泳分析
+    e_val = np.full(n, f"Concentration < {profile.thresholds['min_concentration']:g}", dtype=object)
+    order = np.full(n, 4, dtype=ORDER_DTYPE)
+    gel_error = np.zeros(n, dtype=bool)
+
+    needs_gel = raw_ok & profile.needs_gel(con)
+    if gel_image is None:
+        e_val[needs_gel] = "No Gel Image"
+    else:
+        for i in np.flatnonzero(needs_gel):
+            try:
+                smear, integrity, order_val = analyze_gel_image(_upload_path(gel_image), int(lanes[i]))
+                e_val[i] = f"{smear} / {integrity}"
+                order[i] = int(order_val)
+            except Exception:
+                gel_error[i] = True
+
+    # 錯誤列:數值歸零、等級與電泳標示為 Error、Order 為 4
+    error = ~raw_ok | gel_error
+    level_codes = pd.Categorical(
+        np.where(error, "Error", con_level),
+        dtype=CONCENTRATION_LEVEL_DTYPE
+    ).codes
+
+    return {
+        "sample": samples,
+        "con": con,
+        "ratio_280_260": ratio_280_260,
+        "ratio_260_230": ratio_260_230,
+        "raw_ok": raw_ok,
+        "error": error,
+        "level_code": level_codes,
+        "e_val": np.where(error, "Error", e_val),
+        "order": np.where(error, 4, order).astype(ORDER_DTYPE),
+    }
+
+
+# 備註:逐列增量重新分析
+# 以 plate 名稱 (檔名 + 工作表) 為識別,記錄上次分析時每列的內容雜湊與結果;
+# 同一檔案修正後重新上傳時,只重新判定內容改變的列,也只重新分析這些列的 Lane
+PLATE_CACHE_SIZE = 64
+
+_plate_results = collections.OrderedDict()
+_plate_results_lock = threading.Lock()
+
+
+def _gel_identity(gel_image):
+    """電泳影像識別 (路徑、修改時間、大小),影像改變時整個 plate 重新分析"""
+    path = _upload_path(gel_image)
+    if path is None:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _row_hashes(df_raw):
+    """
+    每列內容雜湊 (只含分析用到的樣本名稱與數值)
+    備註:以轉換後的 float64 數值計算,不含欄位型別;
+         修正一格非數值使整欄型別改變時,其他列的雜湊不變
+    """
+    con, ratio_280_260, ratio_260_230, raw_ok = _extract_measurements(df_raw)
+    normalized = pd.DataFrame({
+        "sample": df_raw.iloc[:, 1].astype(str).to_numpy(dtype=object),
+        "con": con,
+        "ratio_280_260": ratio_280_260,
+        "ratio_260_230": ratio_260_230,
+        "raw_ok": raw_ok,
+    })
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+
+def _analyze_plate_incremental(identity, df_raw, gel_image, profile):
+    """
+    增量分析單一 plate
+    功能:與同一 plate 上次的結果逐列比對內容雜湊,只重新分析改變或新增的列
+    回傳:(block, 重新分析的列數)
+    """
+    hashes = _row_hashes(df_raw)
+    columns = tuple(str(c) for c in df_raw.columns)
+    gel_key = _gel_identity(gel_image)
+
+    with _plate_results_lock:
+        previous = _plate_results.get(identity)
+
+    reusable = (
+        previous is not None
+        and previous["columns"] == columns
+        and previous["gel_key"] == gel_key
+        and previous["profile"] is profile
+    )
+
+    n = len(df_raw)
+    if not reusable:
+        block = _analyze_plate(df_raw, gel_image, profile)
+        reanalyzed = n
+    else:
+        prev_block = previous["block"]
+        common = min(n, len(previous["hashes"]))
+        changed = np.concatenate([
+            np.flatnonzero(hashes[:common] != previous["hashes"][:common]),
+            np.arange(common, n)
+        ])
+        reanalyzed = len(changed)
+
+        if reanalyzed == 0 and n == len(previous["hashes"]):
+            block = prev_block
+        else:
+            # 沿用未改變的列,只把改變的列 (及其 Lane) 重新分析後填回
+            partial = _analyze_plate(df_raw.iloc[changed], gel_image, profile, lanes=changed + 1)
+            block = {}
+            for key, prev_values in prev_block.items():
+                values = np.empty(n, dtype=prev_values.dtype)
+                values[:common] = prev_values[:common]
+                values[changed] = partial[key]
+                block[key] = values
+
+    with _plate_results_lock:
+        _plate_results[identity] = {
+            "hashes": hashes,
+            "columns": columns,
+            "gel_key": gel_key,
+            "profile": profile,
+            "block": block,
+        }
+        _plate_results.move_to_end(identity)
+        while len(_plate_results) > PLATE_CACHE_SIZE:
+            _plate_results.popitem(last=False)
+
+    return block, reanalyzed
+
+
+def _build_analysis_tables(blocks):
+    """
+    將各 plate 的分析結果直接組成具型別的 DataFrame
+    回傳:(analysis_df, raw_data_df)
+    """
+    def column(key, dtype):
+        if not blocks:
+            return np.array([], dtype=dtype)
+        return np.concatenate([block[key] for block in blocks]).astype(dtype)
+
+    samples = column("sample", object)
+    con = column("con", np.float64)
+    ratio_280_260 = column("ratio_280_260", np.float64)
+    ratio_260_230 = column("ratio_260_230", np.float64)
+    raw_ok = column("raw_ok", bool)
+    error = column("error", bool)
+
+    analysis_df = pd.DataFrame({
+        "Sample Name": samples,
+        "Concentration": np.where(error, 0.0, con),
+        "Concentration Level": pd.Categorical.from_codes(
+            column("level_code", np.int8),
+            dtype=CONCENTRATION_LEVEL_DTYPE
+        ),
+        "260/280": np.where(error, 0.0, ratio_280_260).astype(RATIO_DTYPE),
+        "260/230": np.where(error, 0.0, ratio_260_230).astype(RATIO_DTYPE),
+        "Electrophoresis": pd.Categorical(column("e_val", object)),
+        "Order": column("order", ORDER_DTYPE),
+    })
+
+    raw_data_df = pd.DataFrame({
+        "Sample Name": samples[raw_ok],
+        "Raw Concentration": con[raw_ok],
+        "Raw 260/280": ratio_280_260[raw_ok].astype(RATIO_DTYPE),
+        "Raw 260/230": ratio_260_230[raw_ok].astype(RATIO_DTYPE),
+    })
+
+    return analysis_df, raw_data_df
+
+
+def _merge_sorted(keys, rows, new_keys, new_rows):
+    """
+    將一批新資料合併進已排序的陣列
+    功能:只排序新資料,再以 searchsorted 插入,鍵值相同時新資料排在後面 (穩定排序)
+    """
+    order = np.argsort(new_keys, kind="stable")
+    new_keys = new_keys[order]
+    positions = np.searchsorted(keys, new_keys, side="right")
+    return np.insert(keys, positions, new_keys), np.insert(rows, positions, new_rows[order])
+
+
+class SampleRanking:
+    """
+    樣本排序引擎
+    功能:以整數排序鍵維護濃度分組與定序優先順序
+        - 新增樣本時以合併方式更新,不需整表重新排序
+        - 依等級 / Order 分桶,取前 k 筆時只走訪需要的桶
+    列號為樣本加入的順序,對應 analysis_df 的位置
+    """
+
+    def __init__(self):
+        self.size = 0
+        # 濃度分組:每個等級一桶,桶內依 260/230 由高到低 (NaN 最後)
+        self._level_buckets = {}
+        # 定序優先順序:每個 Order 一桶,桶內維持加入順序
+        self._order_buckets = {}
+
+    def add(self, level_codes, ratio_260_230, order):
+        """
+        新增一批樣本
+        參數:
+            - level_codes: 濃度等級的類別代碼 (CONCENTRATION_LEVEL_DTYPE)
+            - ratio_260_230: 260/230 比值
+            - order: 定序優先等級 (1 = 最優)
+        """
+        n = len(order)
+        rows = np.arange(self.size, self.size + n, dtype=np.int64)
+        self.size += n
+
+        # 由高到低排序 → 以負值為鍵遞增排序,NaN 轉為 +inf 排在最後
+        ratio = np.asarray(ratio_260_230, dtype=np.float64)
+        ratio_keys = np.where(np.isnan(ratio), np.inf, -ratio)
+
+        level_codes = np.asarray(level_codes)
+        for code in np.unique(level_codes):
+            mask = level_codes == code
+            keys, bucket_rows = self._level_buckets.get(
+                int(code), (np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64))
+            )
+            self._level_buckets[int(code)] = _merge_sorted(keys, bucket_rows, ratio_keys[mask], rows[mask])
+
+        order = np.asarray(order)
+        for value in np.unique(order):
+            self._order_buckets.setdefault(int(value), []).append(rows[order == value])
+
+    @staticmethod
+    def _take(buckets, limit):
+        """依序串接各桶,達到 limit 筆即停止"""
+        taken = []
+        remaining = limit
+        for bucket in buckets:
+            if remaining is not None:
+                if remaining <= 0:
+                    break
+                bucket = bucket[:remaining]
+                remaining -= len(bucket)
+            taken.append(bucket)
+        if not taken:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(taken)
+
+    def group_rows(self, limit=None):
+        """濃度分組順序:等級由高到低,同等級依 260/230 由高到低"""
+        buckets = (self._level_buckets[code][1] for code in sorted(self._level_buckets, reverse=True))
+        return self._take(buckets, limit)
+
+    def order_rows(self, limit=None):
+        """定序優先順序:Order 由小到大,同等級維持加入順序"""
+        buckets = (
+            chunk
+            for value in sorted(self._order_buckets)
+            for chunk in self._order_buckets[value]
+        )
+        return self._take(buckets, limit)
+
+    def top_k(self, k):
+        """取定序優先順序前 k 筆 (只走訪需要的桶,不排序整表)"""
+        return self.order_rows(limit=k)
+
+
+def _for_display(df):
+    """
+    輸出前將 float32 欄位轉回 float64
+    功能:以最短十進位表示轉換,避免介面與 Excel 出現 1.850000023841858 之類的尾數
+    """
+    if df is None:
+        return None
+    float32_cols = [c for c in df.columns if df[c].dtype == np.float32]
+    if not float32_cols:
+        return df
+    out = df.copy()
+    for c in float32_cols:
+        out[c] = pd.to_numeric(out[c].astype(str))
+    return out
+
+
+def analyze_files(file_objs, gel_image, mode="single", profile=None, incremental=True):
+    """
+    執行濃度分析與電泳分析 (不產生報告檔)
+    功能:供介面與報告共用的分析結果,報告於下載時再由此結果產生
+    參數:
+        - profile: QC profile 名稱,None 時使用預設 profile
+        - incremental: True 時同名 plate 只重新分析內容改變的列
+    回傳:dict - analysis_df / raw_data_df / group_df / order_df / preview_df / mode / profile,
+         total_rows / reanalyzed_rows,plates (每個 plate 的標籤與兩張表的列範圍),
+         plate_qc (每個 plate 的 QC 彙總,供 rollup 使用),
+         以及 plate_keys (每個 plate 的上傳內容 SHA-256 與標籤,rollup 以此辨識重新分析)
+    """
+    profile = get_qc_profile(profile)
+    
+    # 處理每個上傳檔案中的每個 plate (多工作表活頁簿每張表各一個 plate)
+    # 每分析完一個 plate 即併入排序引擎
+    blocks = []
+    plates = []
+    plate_qc = []
+    plate_keys = []
+    ranking = SampleRanking()
+    reanalyzed_rows = 0
+    analysis_offset = raw_offset = 0
+    for source, label, df_raw in iter_source_plates(file_objs):
+        if incremental:
+            block, reanalyzed = _analyze_plate_incremental(label, df_raw, gel_image, profile)
+        else:
+            block, reanalyzed = _analyze_plate(df_raw, gel_image, profile), len(df_raw)
+        reanalyzed_rows += reanalyzed
+        blocks.append(block)
+        # 記錄每個 plate 在合併表格中的列範圍,分 plate 輸出時直接切片,不需重新解析
+        n_analysis, n_raw = len(block["sample"]), int(np.count_nonzero(block["raw_ok"]))
+        plates.append((
+            label,
+            (analysis_offset, analysis_offset + n_analysis),
+            (raw_offset, raw_offset + n_raw)
+        ))
+        analysis_offset += n_analysis
+        raw_offset += n_raw
+        plate_qc.append(plate_qc_summary(block, profile))
+        plate_keys.append(f"{source}|{label}")
+        ranking.add(
+            block["level_code"],
+            np.where(block["error"], 0.0, block["ratio_260_230"]).astype(RATIO_DTYPE),
+            block["order"]
+        )
+    
+    # 建立分析結果與原始數據 DataFrame
+    analysis_df, raw_data_df = _build_analysis_tables(blocks)
+
+    # 建立濃度分組表 (等級由高到低,同等級依 260/230 由高到低)
+    group_df = analysis_df[
+        [
+            "Sample Name", 
+            "Concentration", 
+            "Concentration Level", 
+            "260/230"
+        ]
+    ].take(ranking.group_rows())
+
+    # 建立定序優先順序表
+    order_df = analysis_df[
+        [
+            "Sample Name", 
+            "Order", 
+            "Electrophoresis"
+        ]
+    ].take(ranking.order_rows())
+    
+    order_df['Rank'] = range(1, len(order_df) + 1)
+
+    # 建立預覽表 - 定序優先順序前 10 筆
+    preview_df = analysis_df[
+        [
+            "Sample Name", 
+            "Concentration", 
+            "Concentration Level",
+            "Order"
+        ]
+    ].take(ranking.top_k(10))
+
+    return {
+        "analysis_df": analysis_df,
+        "raw_data_df": raw_data_df,
+        "group_df": group_df,
+        "order_df": order_df,
+        "preview_df": preview_df,
+        "mode": mode,
+        "profile": profile.name,
+        "plates": plates,
+        "plate_qc": plate_qc,
+        "plate_keys": plate_keys,
+        "total_rows": len(analysis_df),
+        "reanalyzed_rows": reanalyzed_rows,
+    }
+
+
+REPORT_FORMATS = {"Excel Workbook": "xlsx", "Zip Bundle (one report per plate)": "zip"}
+if pa is not None:
+    REPORT_FORMATS["Arrow IPC Tables (zip)"] = "arrow"
+REPORT_FORMATS["JSON Tables"] = "json"
+
+
+def report_filename(mode, fmt="xlsx"):
+    """
+    報告檔名 (單檔 / 多檔分析)
+    fmt:xlsx 單一活頁簿 / zip 分 plate 報告 / arrow Arrow IPC 表格 / json JSON 表格
+    """
+    prefix = "Single" if mode == "single" else "Multiple"
+    if fmt == "zip":
+        return f"{prefix}_Analysis_Reports.zip"
+    if fmt == "arrow":
+        return f"{prefix}_Analysis_Arrow.zip"
+    if fmt == "json":
+        return f"{prefix}_Analysis.json"
+    return f"{prefix}_Analysis_Report.xlsx"
+
+
+def write_analysis_report(result, save_path):
+    """
+    將分析結果寫成 Excel 報告
+    功能:raw data 在上方,空一行後接分析結果
+    """
+    raw_data_df = _for_display(result["raw_data_df"])
+    analysis_df = _for_display(result["analysis_df"])
+    
+    with pd.ExcelWriter(save_path, engine='openpyxl') as writer:
+        raw_data_df.to_excel(writer, sheet_name='Analysis Report',
+                              index=False, startrow=0)
+        
+        separator_row = len(raw_data_df) + 2
+        
+        analysis_df.to_excel(writer, sheet_name='Analysis Report',
+                              index=False, startrow=separator_row)
+        
+        # 凍結 raw data 標題列,並設定兩個區塊的數值格式
+        ws = writer.sheets['Analysis Report']
+        ws.freeze_panes = 'A2'
+        format_excel_block(ws, raw_data_df, header_row=1)
+        format_excel_block(ws, analysis_df, header_row=separator_row + 1)
+    
+    return save_path
+
+
+def iter_plate_tables(result):
+    """
+    依 plate 逐一取出分析結果
+    功能:使用分析時記錄的列範圍切片,不重新解析檔案,也不複製整張表
+    回傳:generator of (plate_label, raw_data_df, analysis_df)
+    """
+    analysis_df, raw_data_df = result["analysis_df"], result["raw_data_df"]
+    for label, (a_start, a_stop), (r_start, r_stop) in result["plates"]:
+        yield label, raw_data_df.iloc[r_start:r_stop], analysis_df.iloc[a_start:a_stop]
+
+
+def _plate_report_bytes(raw_data_df, analysis_df):
+    """單一 plate 的精簡報告 (raw data 與分析結果各一張工作表),回傳 xlsx 檔案內容"""
+    raw_data_df = _for_display(raw_data_df)
+    analysis_df = _for_display(analysis_df)
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+        for sheet_name, df in (("Raw Data", raw_data_df), ("Analysis", analysis_df)):
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+            ws = writer.sheets[sheet_name]
+            ws.freeze_panes = 'A2'
+            format_excel_block(ws, df, header_row=1)
+    return buffer.getvalue()
+
+
+def _plate_summary_row(label, analysis_df):
+    """摘要表的一列:樣本數、各濃度等級與各 Order 的樣本數"""
+    levels = analysis_df["Concentration Level"].value_counts()
+    orders = analysis_df["Order"].value_counts()
+    valid = analysis_df["Concentration Level"] != "Error"
+    row = {
+        "Plate": label,
+        "Samples": len(analysis_df),
+        "Mean Concentration": float(analysis_df["Concentration"][valid].mean()) if valid.any() else 0.0,
+    }
+    for level in reversed(CONCENTRATION_LEVEL_DTYPE.categories):
+        row[level] = int(levels.get(level, 0))
+    for order in range(1, 5):
+        row[f"Order {order}"] = int(orders.get(order, 0))
+    return row
+
+
+def _bundle_member_name(label, used):
+    """由 plate 標籤產生 zip 內的檔名 (去掉來源副檔名、移除路徑字元,重複時加序號)"""
+    file_name, bracket, sheet = label.partition(" [")
+    stem = os.path.splitext(file_name)[0] + bracket + sheet
+    stem = "".join(ch if ch.isalnum() or ch in " ._-[]()" else "_" for ch in stem).strip(" .") or "plate"
+    name, n = f"{stem}.xlsx", 2
+    while name in used:
+        name, n = f"{stem} ({n}).xlsx", n + 1
+    used.add(name)
+    return name
+
+
+def write_report_bundle(plate_tables, save_path):
+    """
+    將分 plate 報告串流寫入 zip
+    參數:
+        - plate_tables: iterable of (plate_label, raw_data_df, analysis_df),可為 generator
+    功能:每個 plate 產生精簡報告後立即寫入 zip,記憶體只保留一個 plate 的報告;最後加入 Summary.xlsx
+    """
+    summary_rows = []
+    used_names = {"Summary.xlsx"}
+    # 備註:xlsx 本身已壓縮,以 ZIP_STORED 寫入避免重複壓縮
+    with zipfile.ZipFile(save_path, "w", compression=zipfile.ZIP_STORED) as bundle:
+        for label, raw_data_df, analysis_df in plate_tables:
+            bundle.writestr(_bundle_member_name(label, used_names), _plate_report_bytes(raw_data_df, analysis_df))
+            summary_rows.append(_plate_summary_row(label, analysis_df))
+        
+        summary_df = pd.DataFrame(summary_rows)
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+            summary_df.to_excel(writer, sheet_name="Summary", index=False)
+            ws = writer.sheets["Summary"]
+            ws.freeze_panes = 'A2'
+            format_excel_block(ws, summary_df, header_row=1)
+        bundle.writestr("Summary.xlsx", buffer.getvalue())
+    
+    return save_path
+
+
+def analysis_outputs(result, save_path=None, message=None):
+    """將分析結果整理為介面輸出順序"""
+    if message is None:
+        message = "Analysis completed"
+        # 有沿用上次結果時,顯示實際重新分析的列數
+        if result["reanalyzed_rows"] < result["total_rows"]:
+            message += f" (re-analyzed {result['reanalyzed_rows']} of {result['total_rows']} rows)"
+    return (
+        _for_display(result["analysis_df"]),
+        save_path,
+        _for_display(result["group_df"]),
+        result["order_df"],
+        result["preview_df"],
+        message
+    )
+
+
+def run_master_analysis(file_objs, gel_image, mode="single", write_report=False, profile=None):
+    """
+    主分析系統 - 執行完整的品質分析流程
+    功能:整合濃度分析、電泳分析,需要時生成完整報告
+    參數:
+        - write_report: True 時立即寫出 Excel 報告並回傳路徑,否則報告路徑為 None
+        - profile: QC profile 名稱,None 時使用預設 profile
+    """
+    if not file_objs:
+        return None, None, None, None, None, "Please upload analysis files"
+    
+    result = analyze_files(file_objs, gel_image, mode, profile)
+    record_qc_rollup(result)
+    
+    save_path = None
+    if write_report:
+        save_path = write_analysis_report(result, os.path.abspath(report_filename(mode)))
+    
+    return analysis_outputs(result, save_path)
+
+
+# --- 3.1 Lazy Report Cache ---
+
+# 備註:分析結果暫存,報告於使用者按下載時才產生
+# 設定 ANALYSIS_REPORT_PREBUILD=1 時,分析完成後即在背景執行緒預先產生報告
+# 每筆結果的各格式報告放在同一個暫存資料夾,結果被淘汰時連同資料夾刪除
+# ⚠️ REPORT_WORKERS 為同時產生報告的執行緒數,避免單一大型報告卡住其他使用者的下載
+REPORT_CACHE_SIZE = 16
+REPORT_PREBUILD = os.environ.get("ANALYSIS_REPORT_PREBUILD", "0") == "1"
+REPORT_WORKERS = int(os.environ.get("ANALYSIS_REPORT_WORKERS", "4"))
+
+_report_cache = collections.OrderedDict()
+_report_cache_lock = threading.Lock()
+_report_executor = concurrent.futures.ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+
+
+def cache_analysis_result(result):
+    """
+    暫存分析結果並回傳識別碼 (存入 gr.State)
+    功能:超過 REPORT_CACHE_SIZE 筆時淘汰最舊的結果
+    """
+    token = uuid.uuid4().hex
+    entry = {"result": result, "futures": {}, "dir": tempfile.mkdtemp(prefix=f"analysis_{token[:8]}_")}
+    if REPORT_PREBUILD:
+        entry["futures"]["xlsx"] = _report_executor.submit(_build_cached_report, entry, "xlsx")
+    
+    evicted = []
+    with _report_cache_lock:
+        _report_cache[token] = entry
+        while len(_report_cache) > REPORT_CACHE_SIZE:
+            evicted.append(_report_cache.popitem(last=False)[1])
+    
+    for old in evicted:
+        _discard_report_entry(old)
+    
+    return token
+
+
+def _discard_report_entry(entry):
+    """刪除被淘汰結果的報告資料夾;仍在產生中的報告完成後才刪除"""
+    futures = list(entry["futures"].values())
+    if not futures:
+        shutil.rmtree(entry["dir"], ignore_errors=True)
+        return
+    
+    def _remove_when_done(_):
+        if all(f.done() for f in futures):
+            shutil.rmtree(entry["dir"], ignore_errors=True)
+    
+    for future in futures:
+        future.add_done_callback(_remove_when_done)
+
+
+def clear_report_cache():
+    """清空暫存結果並刪除所有報告資料夾 (程式結束時呼叫)"""
+    with _report_cache_lock:
+        entries = list(_report_cache.values())
+        _report_cache.clear()
+    for entry in entries:
+        _discard_report_entry(entry)
+
+
+def _build_cached_report(entry, fmt):
+    """在該筆結果專屬的暫存資料夾產生報告,避免不同使用者的報告互相覆蓋"""
+    result = entry["result"]
+    save_path = os.path.join(entry["dir"], report_filename(result["mode"], fmt))
+    if fmt == "zip":
+        return write_report_bundle(iter_plate_tables(result), save_path)
+    if fmt == "arrow":
+        return write_arrow_bundle(result, save_path)
+    if fmt == "json":
+        return write_analysis_json(result, save_path)
+    return write_analysis_report(result, save_path)
+
+
+def get_analysis_report(token, fmt="xlsx"):
+    """
+    取得報告檔路徑
+    參數:
+        - fmt: "xlsx" 單一活頁簿 / "zip" 分 plate 報告壓縮檔
+    功能:已有背景產生的報告則直接使用,否則當下產生一次並記錄
+    回傳:報告路徑,結果已過期時回傳 None
+    """
+    with _report_cache_lock:
+        entry = _report_cache.get(token)
+        if entry is None:
+            return None
+        future = entry["futures"].get(fmt)
+        if future is None:
+            future = _report_executor.submit(_build_cached_report, entry, fmt)
+            entry["futures"][fmt] = future
+    
+    try:
+        return future.result()
+    except Exception:
+        # 產生失敗時清除,下次點擊可重新產生
+        with _report_cache_lock:
+            entry["futures"].pop(fmt, None)
+        raise
+
+
+def get_analysis_result(token):
+    """取得暫存的分析結果,已過期時回傳 None"""
+    with _report_cache_lock:
+        entry = _report_cache.get(token)
+    return None if entry is None else entry["result"]
+
+
+# --- 3.2 Threshold Calibration ---
+
+def qc_status_vectorized(con, ratio_280_260, ratio_260_230, thresholds):
+    """
+    向量化品質判定 (與載入時逐筆判定規則相同)
+    參數:
+        - con / ratio_*: 樣本數值陣列
+        - thresholds: QC_THRESHOLDS 格式的 dict,值可為純量或可廣播的陣列
+    回傳:(fail, passed) 布林陣列,兩者皆 False 即 ACCEPTABLE
+    """
+    t = thresholds
+    fail = _qc_issue_bits(con, ratio_280_260, ratio_260_230, t) != 0
+    passed = (
+        ~fail
+        & (con >= t["pass_concentration"])
+        & (ratio_280_260 >= t["pass_ratio_280"])
+        & (ratio_260_230 >= t["pass_ratio_230"])
+    )
+    return fail, passed
+
+
+def gel_order_vectorized(avg, bright_20k, bright_5k, bright_3k, thresholds):
+    """
+    向量化電泳 Order 判定 (與 analyze_gel_image 的結果相同)
+    功能:
+        - 20k 區域可見且拖尾狀態字串保留 → Order 1
+        - 20k 不可見但 5k / 3k 可見 → Order 2
+        - 其餘 → Order 4
+    備註:拖尾分支最後只有「平均亮度等於 20k 最大亮度且不低於 5k」時狀態字串不會被清空
+    """
+    t = thresholds
+    keeps_status = (avg <= t["smear_brightness"]) | ((avg == bright_20k) & ~(avg < bright_5k))
+    visible = bright_20k > t["band_brightness"]
+    medium = ~visible & ((bright_5k > t["band_brightness"]) | (bright_3k > t["band_brightness"]))
+    return np.where(keeps_status & visible, 1, np.where(medium, 2, 4)).astype(ORDER_DTYPE)
+
+
+def _extract_calibration_columns(file_objs, gel_image):
+    """
+    預先取出校正所需欄位 (只解析一次)
+    回傳:dict - 濃度、比值、可解析遮罩,以及每個樣本對應 Lane 的電泳統計值
+    """
+    columns = {key: [] for key in ("con", "r280", "r230", "raw_ok", "lane")}
+    for _, df_raw in list_stunner_plates(file_objs):
+        n = len(df_raw)
+        con, r280, r230, raw_ok = _extract_measurements(df_raw)
+        columns["con"].append(con)
+        columns["r280"].append(r280)
+        columns["r230"].append(r230)
+        columns["raw_ok"].append(raw_ok)
+        # 第 i 個樣本對應第 i+1 條 Lane
+        columns["lane"].append(np.arange(1, n + 1))
+
+    data = {key: np.concatenate(values) if values else np.array([]) for key, values in columns.items()}
+    data["raw_ok"] = data["raw_ok"].astype(bool)
+
+    n = len(data["con"])
+    gel_stats = np.full((4, n), np.nan)
+    gel_ok = np.zeros(n, dtype=bool)
+    gel = load_gel_densitometry(_upload_path(gel_image)) if gel_image is not None else None
+    if gel is not None:
+        avg, b20, b5, b3, lane_ok = gel.all_lane_statistics()
+        in_image = data["lane"] < gel.lane_count
+        lanes = data["lane"][in_image].astype(int)
+        gel_ok[in_image] = lane_ok[lanes]
+        for k, values in enumerate((avg, b20, b5, b3)):
+            gel_stats[k, in_image] = values[lanes]
+
+    data["gel_stats"] = gel_stats
+    data["gel_ok"] = gel_ok
+    data["has_gel"] = gel is not None
+    return data
+
+
+# ⚠️ 門檻組合數上限:組合數為各門檻候選值個數的乘積,超過時拒絕 (結果表也會送到介面)
+CALIBRATION_MAX_SETTINGS = int(os.environ.get("ANALYSIS_CALIBRATION_MAX_SETTINGS", "10000"))
+
+
+def _threshold_grid(qc_grid, gel_grid, baseline):
+    """
+    將各門檻的候選值展開為所有組合
+    參數:
+        - baseline: 未指定候選值時使用的 QC 門檻
+    回傳:(欄位名稱清單, shape = (組合數, 門檻數) 的陣列)
+    例外:ValueError - 組合數超過 CALIBRATION_MAX_SETTINGS (在展開前檢查)
+    """
+    grid = {key: [value] for key, value in {**baseline, **GEL_THRESHOLDS}.items()}
+    for key, values in {**(qc_grid or {}), **(gel_grid or {})}.items():
+        if key not in grid:
+            raise ValueError(f"Unknown threshold: {key}")
+        grid[key] = list(dict.fromkeys(values))
+
+    combinations = 1
+    for values in grid.values():
+        combinations *= len(values)
+    if combinations > CALIBRATION_MAX_SETTINGS:
+        raise ValueError(
+            f"{combinations:,} threshold combinations requested "
+            f"(limit {CALIBRATION_MAX_SETTINGS:,}); use fewer candidate values"
+        )
+
+    names = list(grid)
+    mesh = np.meshgrid(*[np.asarray(grid[name], dtype=np.float64) for name in names], indexing="ij")
+    return names, np.stack([m.ravel() for m in mesh], axis=1)
+
+
+def calibrate_thresholds(file_objs, gel_image=None, qc_grid=None, gel_grid=None, chunk_size=256, profile=None):
+    """
+    門檻校正 - 一次評估多組門檻組合
+    功能:歷史 plate 只解析一次,所有門檻組合以向量化方式同時計算
+    參數:
+        - qc_grid: {QC_THRESHOLDS 欄位: [候選值, ...]},未指定的欄位使用目前設定
+        - gel_grid: {GEL_THRESHOLDS 欄位: [候選值, ...]}
+        - chunk_size: 每次同時計算的組合數,限制暫存陣列大小
+        - profile: 作為基準的 QC profile
+    回傳:DataFrame,每列為一組門檻與其 PASS/ACCEPTABLE/FAIL/ERROR 及 Order 1-4 分佈
+    """
+    data = _extract_calibration_columns(file_objs, gel_image)
+    names, settings = _threshold_grid(qc_grid, gel_grid, get_qc_profile(profile).thresholds)
+
+    con = data["con"][None, :]
+    r280 = data["r280"][None, :]
+    r230 = data["r230"][None, :]
+    raw_ok = data["raw_ok"][None, :]
+    avg, b20, b5, b3 = (row[None, :] for row in data["gel_stats"])
+    gel_ok = data["gel_ok"][None, :]
+
+    counts = []
+    for start in range(0, len(settings), chunk_size):
+        chunk = settings[start:start + chunk_size]
+        t = {name: chunk[:, k:k + 1] for k, name in enumerate(names)}
+
+        fail, passed = qc_status_vectorized(con, r280, r230, t)
+        fail &= raw_ok
+        passed &= raw_ok
+
+        # 濃度達標且電泳可分析的樣本才依電泳判定 Order,其餘為 4
+        order = np.full(fail.shape, 4, dtype=ORDER_DTYPE)
+        if data["has_gel"]:
+            gel_rows = raw_ok & gel_ok & (con >= t["min_concentration"])
+            gel_order = gel_order_vectorized(avg, b20, b5, b3, t)
+            order = np.where(gel_rows, gel_order, order)
+
+        chunk_counts = {
+            "PASS": passed.sum(axis=1),
+            "ACCEPTABLE": (raw_ok & ~fail & ~passed).sum(axis=1),
+            "FAIL": fail.sum(axis=1),
+            "ERROR": np.broadcast_to((~raw_ok).sum(axis=1), (len(chunk),)),
+        }
+        for value in (1, 2, 3, 4):
+            chunk_counts[f"Order {value}"] = (order == value).sum(axis=1)
+        counts.append(pd.DataFrame(chunk_counts))
+
+    result = pd.DataFrame(settings, columns=names)
+    if counts:
+        result = pd.concat([result, pd.concat(counts, ignore_index=True)], axis=1)
+    n_samples = len(data["con"])
+    result["Pass Rate"] = (result["PASS"] / n_samples).round(4) if n_samples else 0.0
+    return result
+
+
+def _parse_grid_values(text):
+    """將 "1.8, 1.85, 1.9" 之類的輸入轉為數值清單"""
+    values = [item.strip() for item in str(text).replace(";", ",").split(",")]
+    return [float(item) for item in values if item]
+
+
+# --- 3.3 Cross-Plate Sample Index ---
+
+SEARCH_RESULT_LIMIT = 200
+SEARCH_MODES = ("Auto", "Exact", "Prefix", "Substring")
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SampleIndex:
+    """
+    跨 plate 樣本名稱索引
+    功能:
+        - 完全比對:dict 查詢
+        - 前綴比對:排序後的名稱以二分搜尋定位
+        - 子字串比對:三字元 (trigram) 反向索引先篩選候選,再逐一確認
+        - 標記在多個 plate 出現的相同樣本名稱
+    比對不分大小寫
+    """
+
+    def __init__(self, plates):
+        plate_labels, rows, names, values = [], [], [], {key: [] for key in ("con", "r280", "r230", "quality")}
+        for plate_idx, (label, df) in enumerate(plates):
+            n = len(df)
+            if n == 0 or df.shape[1] < 2:
+                continue
+            con, r280, r230, _ = _extract_measurements(df)
+            plate_labels.append(np.full(n, plate_idx))
+            rows.append(np.arange(n))
+            names.append(df.iloc[:, 1].astype(str).to_numpy(dtype=object))
+            values["con"].append(con)
+            values["r280"].append(r280)
+            values["r230"].append(r230)
+            quality = df["Quality Check"] if "Quality Check" in df.columns else pd.Series([""] * n)
+            values["quality"].append(quality.astype(str).to_numpy(dtype=object))
+
+        def join(parts, dtype):
+            return np.concatenate(parts) if parts else np.array([], dtype=dtype)
+
+        self.plate_names = [label for label, _ in plates]
+        self.plate = join(plate_labels, np.int64)
+        self.row = join(rows, np.int64)
+        self.name = join(names, object)
+        self.con = join(values["con"], np.float64)
+        self.r280 = join(values["r280"], np.float64)
+        self.r230 = join(values["r230"], np.float64)
+        self.quality = join(values["quality"], object)
+
+        # 名稱 (小寫) → 項目編號
+        self._exact = collections.defaultdict(list)
+        for entry, name in enumerate(self.name):
+            self._exact[name.casefold()].append(entry)
+        self._keys = sorted(self._exact)
+
+        self._trigram_index = collections.defaultdict(set)
+        for key_id, key in enumerate(self._keys):
+            for gram in _trigrams(key):
+                self._trigram_index[gram].add(key_id)
+
+        # 出現在兩個以上 plate 的名稱
+        self.duplicates = {
+            key: sorted({int(self.plate[e]) for e in entries})
+            for key, entries in self._exact.items()
+            if len({int(self.plate[e]) for e in entries}) > 1
+        }
+
+    def __len__(self):
+        return len(self.name)
+
+    def _exact_keys(self, query):
+        return [query] if query in self._exact else []
+
+    def _prefix_keys(self, query):
+        start = bisect.bisect_left(self._keys, query)
+        end = bisect.bisect_left(self._keys, query + "\U0010ffff")
+        return self._keys[start:end]
+
+    def _substring_keys(self, query):
+        grams = _trigrams(query)
+        if not grams:
+            # 少於三個字元時無法使用 trigram,直接掃描名稱
+            return [key for key in self._keys if query in key]
+        candidates = set.intersection(*(self._trigram_index.get(g, set()) for g in grams))
+        return [self._keys[k] for k in sorted(candidates) if query in self._keys[k]]
+
+    def search(self, query, mode="Auto", limit=SEARCH_RESULT_LIMIT):
+        """
+        搜尋樣本名稱
+        參數:
+            - mode: Exact / Prefix / Substring;Auto 依序列出完全、前綴、子字串比對結果
+        回傳:DataFrame - Plate、Row、樣本數值、品質判定、比對方式與是否重複
+        """
+        query = str(query or "").strip().casefold()
+        if not query:
+            return self._result_frame([], [])
+
+        finders = {
+            "Exact": self._exact_keys,
+            "Prefix": self._prefix_keys,
+            "Substring": self._substring_keys,
+        }
+        modes = list(finders) if mode == "Auto" else [mode]
+
+        entries, match_types, seen = [], [], set()
+        for match in modes:
+            for key in finders[match](query):
+                if key in seen:
+                    continue
+                seen.add(key)
+                for entry in self._exact[key]:
+                    entries.append(entry)
+                    match_types.append(match)
+                if len(entries) >= limit:
+                    return self._result_frame(entries[:limit], match_types[:limit])
+        return self._result_frame(entries, match_types)
+
+    def _result_frame(self, entries, match_types):
+        entries = np.asarray(entries, dtype=np.int64)
+        names = self.name[entries]
+        return pd.DataFrame({
+            "Plate": [self.plate_names[p] for p in self.plate[entries]],
+            "Row": self.row[entries] + 1,
+            "Sample Name": names,
+            "Concentration": self.con[entries],
+            "260/280": self.r280[entries],
+            "260/230": self.r230[entries],
+            "Quality Check": self.quality[entries],
+            "Match": match_types,
+            "Duplicate": [str(name).casefold() in self.duplicates for name in names],
+        })
+
+    def duplicate_summary(self):
+        """重複樣本名稱說明文字"""
+        if not self.duplicates:
+            return "No duplicate sample names across plates"
+        lines = [
+            f"{self.name[self._exact[key][0]]}: " + ", ".join(self.plate_names[p] for p in plates)
+            for key, plates in sorted(self.duplicates.items())
+        ]
+        return f"{len(lines)} sample names appear on more than one plate:\n" + "\n".join(lines)
+
+
+def build_sample_index(file_objs, profile=None):
+    """
+    解析上傳檔案並建立跨 plate 樣本索引
+    功能:每個 plate 加上品質判定後建立索引,供搜尋框即時查詢
+    """
+    profile = get_qc_profile(profile)
+    plates = [
+        (label, _apply_quality_check(df, profile))
+        for label, df in list_stunner_plates(file_objs)
+    ]
+    return SampleIndex(plates)
+
+
+# --- 3.4 Request Profiling ---
+
+# 備註:設定 ANALYSIS_PROFILE=1 或於 Diagnostics 區開啟後,被 @profiled 包裝的 handler 每次呼叫都以 cProfile 記錄
+# 每次請求存成一個 .pstats 檔 (可用 snakeviz / flameprof 產生火焰圖),只保留最新 ANALYSIS_PROFILE_KEEP 個
+# 請求中交給 worker pool 的工作也在 worker 內以 cProfile 記錄,統計併入同一個 .pstats 檔
+PROFILE_DIR = os.path.join(ANALYSIS_DATA_DIR, "profiles")
+PROFILE_KEEP = int(os.environ.get("ANALYSIS_PROFILE_KEEP", "50"))
+
+_profiling_enabled = threading.Event()
+if os.environ.get("ANALYSIS_PROFILE", "0") == "1":
+    _profiling_enabled.set()
+_profile_dir_lock = threading.Lock()
+# 目前執行緒正在記錄的請求:worker 回傳的統計暫存於此,請求結束時併入
+_request_profile = threading.local()
+
+
+def set_request_profiling(enabled):
+    """開啟 / 關閉請求分析 (對所有使用者生效)"""
+    if enabled:
+        _profiling_enabled.set()
+    else:
+        _profiling_enabled.clear()
+
+
+def request_profiling_enabled():
+    return _profiling_enabled.is_set()
+
+
+def record_worker_profile(stats):
+    """併入 worker 回傳的 cProfile 統計 (目前執行緒未在記錄請求時忽略)"""
+    worker_stats = getattr(_request_profile, "worker_stats", None)
+    if worker_stats is not None and stats:
+        worker_stats.append(stats)
+
+
+def _save_profile(profiler, name, elapsed, worker_stats=()):
+    """寫出 .pstats (含 worker 端統計) 並刪除超過保留數量的舊檔"""
+    stats = pstats.Stats(profiler)
+    for raw in worker_stats:
+        worker = pstats.Stats()
+        worker.stats = raw
+        worker.get_top_level_stats()
+        stats.add(worker)
+    
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    file_name = f"{stamp}_{name}_{elapsed * 1000:.0f}ms_{uuid.uuid4().hex[:6]}.pstats"
+    with _profile_dir_lock:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, file_name)
+        stats.dump_stats(path)
+        
+        dumps = sorted(
+            (entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".pstats")),
+            key=lambda entry: entry.stat().st_mtime_ns
+        )
+        for entry in dumps[:max(len(dumps) - PROFILE_KEEP, 0)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    return path
+
+
+def profiled(func):
+    """
+    請求分析裝飾器
+    功能:分析開啟時以 cProfile 記錄單次呼叫並存檔;關閉時直接呼叫原函式,不增加額外負擔
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _profiling_enabled.is_set():
+            return func(*args, **kwargs)
+        
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 同一時間已有其他分析器在執行 (例如外部 profiler),此次不記錄
+            return func(*args, **kwargs)
+        
+        start = time.perf_counter()
+        _request_profile.worker_stats = []
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            worker_stats, _request_profile.worker_stats = _request_profile.worker_stats, None
+            try:
+                _save_profile(profiler, func.__name__, time.perf_counter() - start, worker_stats)
+            except OSError:
+                # 存檔失敗不影響請求結果
+                pass
+    
+    return wrapper
+
+
+# --- 3.5 Warm Worker Pool ---
+
+# 備註:Excel 解析與電泳建表在常駐的 worker 程序中執行,不受 GIL 限制,多位使用者可同時處理
+# worker 由 forkserver 分叉:pandas / openpyxl / cv2 等套件在 forkserver 載入一次,新 worker 只需執行本檔內容
+# ANALYSIS_WORKERS=0 時停用,所有工作於本程序執行
+# ⚠️ ANALYSIS_WORKER_MAX_TASKS:每個 worker 處理幾個工作後重新建立
+# ⚠️ ANALYSIS_WORKER_MAX_RSS_MB:worker 記憶體超過此值時整個 pool 換新 (0 表示不限制)
+WORKER_COUNT = int(os.environ.get("ANALYSIS_WORKERS", str(min(4, os.cpu_count() or 1))))
+WORKER_MAX_TASKS = int(os.environ.get("ANALYSIS_WORKER_MAX_TASKS", "100"))
+WORKER_MAX_RSS_MB = int(os.environ.get("ANALYSIS_WORKER_MAX_RSS_MB", "1024"))
+_WORKER_PRELOAD = ["__main__", "numpy", "pandas", "cv2", "openpyxl", "gradio"]
+
+
+def _current_rss_mb():
+    """本程序目前的常駐記憶體 (MB),無法讀取時回傳 None"""
+    try:
+        with open("/proc/self/statm") as fh:
+            resident_pages = int(fh.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _warm_worker():
+    """worker 初始化:先觸發 pandas 的 Excel 讀取器載入,第一個工作不必等待"""
+    import openpyxl.reader.excel  # noqa: F401
+
+
+def _pool_job(func, args, profile=False):
+    """
+    在 worker 中執行工作,一併回報 worker 記憶體供主程序判斷是否換新
+    profile=True 時以 cProfile 記錄並回傳統計 (主程序正在記錄請求時)
+    回傳:(result, rss_mb, profile_stats 或 None)
+    """
+    if not profile:
+        return func(*args), _current_rss_mb(), None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        result = func(*args)
+    finally:
+        profiler.disable()
+    profiler.create_stats()
+    return result, _current_rss_mb(), profiler.stats
+
+
+class WorkerPool:
+    """
+    常駐 worker pool
+    功能:包裝 ProcessPoolExecutor,worker 處理 max_tasks 個工作後自動重建;
+         回報的記憶體超過 max_rss_mb 時,以新 pool 取代舊 pool (舊 pool 完成手上工作後結束)
+    """
+
+    def __init__(self, workers, max_tasks=None, max_rss_mb=None):
+        self.workers = workers
+        self.max_tasks = max_tasks or None
+        self.max_rss_mb = max_rss_mb or None
+        self._executor = None
+        self._lock = threading.Lock()
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        if self._context.get_start_method() == "forkserver":
+            self._context.set_forkserver_preload(_WORKER_PRELOAD)
+
+    def _new_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=self._context,
+            initializer=_warm_worker,
+            max_tasks_per_child=self.max_tasks
+        )
+
+    def start(self):
+        """建立 worker 並等待全部就緒"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            executor = self._executor
+        concurrent.futures.wait([executor.submit(_current_rss_mb) for _ in range(self.workers)])
+        return self
+
+    @property
+    def running(self):
+        return self._executor is not None
+
+    def run(self, func, *args):
+        """送出工作並等待結果"""
+        with self._lock:
+            executor = self._executor
+        if executor is None:
+            return func(*args)
+        
+        try:
+            profile = getattr(_request_profile, "worker_stats", None) is not None
+            result, rss_mb, stats = executor.submit(_pool_job, func, args, profile).result()
+        except concurrent.futures.process.BrokenProcessPool as e:
+            # worker 異常結束 (例如記憶體不足被系統終止),換新 pool 並回報錯誤
+            # 備註:不改在本程序重跑,避免同一份輸入讓伺服器本身也記憶體不足
+            self._replace(executor)
+            raise RuntimeError("Worker process terminated unexpectedly (input may be too large)") from e
+        
+        record_worker_profile(stats)
+        if self.max_rss_mb and rss_mb is not None and rss_mb > self.max_rss_mb:
+            self._replace(executor)
+        return result
+
+    def _replace(self, executor):
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = self._new_executor()
+        executor.shutdown(wait=False)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+_worker_pool = None
+
+
+def start_worker_pool():
+    """啟動 worker pool (只在主程式執行時呼叫);ANALYSIS_WORKERS=0 時不啟動"""
+    global _worker_pool
+    if _worker_pool is None and WORKER_COUNT > 0:
+        _worker_pool = WorkerPool(WORKER_COUNT, WORKER_MAX_TASKS, WORKER_MAX_RSS_MB).start()
+    return _worker_pool
+
+
+def stop_worker_pool():
+    global _worker_pool
+    pool, _worker_pool = _worker_pool, None
+    if pool is not None:
+        pool.shutdown()
+
+
+def run_in_worker_pool(func, *args):
+    """
+    在 worker pool 執行 func(*args)
+    功能:pool 未啟動 (匯入為模組、worker 本身、或已停用) 時直接於本程序執行
+    """
+    pool = _worker_pool
+    if pool is None:
+        return func(*args)
+    return pool.run(func, *args)
+
+
+# --- 3.6 Plate Heatmap ---
+
+# 備註:樣本依列優先 (A1, A2, ... A12, B1 ...) 對應到孔盤位置,依樣本數選擇 96 / 384 / 1536 孔版型
+# 熱圖以整張影像送到瀏覽器,依分析結果內容雜湊、plate 與指標快取,切換時不需重新繪製
+PLATE_LAYOUTS = ((96, 8, 12), (384, 16, 24), (1536, 32, 48))
+HEATMAP_METRICS = {
+    "Concentration": "Concentration",
+    "260/280": "260/280",
+    "260/230": "260/230",
+    "Order": "Order",
+}
+HEATMAP_CACHE_SIZE = 64
+_HEATMAP_CELL_PX = {96: 48, 384: 28, 1536: 14}
+_HEATMAP_MARGIN = 28
+_HEATMAP_LEGEND_PX = 70
+_HEATMAP_EMPTY = np.array([60, 60, 60], dtype=np.uint8)
+_HEATMAP_ERROR = np.array([200, 40, 40], dtype=np.uint8)
+
+_heatmap_cache = collections.OrderedDict()
+_heatmap_cache_lock = threading.Lock()
+
+
+def plate_layout(n_samples):
+    """依樣本數選擇孔盤版型,回傳 (wells, rows, cols);超過 1536 時延長列數"""
+    for wells, rows, cols in PLATE_LAYOUTS:
+        if n_samples <= wells:
+            return wells, rows, cols
+    wells, rows, cols = PLATE_LAYOUTS[-1]
+    rows = -(-n_samples // cols)
+    return rows * cols, rows, cols
+
+
+def _row_label(index):
+    """孔盤列名稱:A-Z,之後為 AA、AB ..."""
+    label = ""
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        label = chr(ord("A") + rem) + label
+    return label
+
+
+def analysis_result_hash(result):
+    """分析結果內容雜湊 (第一次計算後記錄在結果中)"""
+    digest = result.get("hash")
+    if digest is None:
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(pd.util.hash_pandas_object(result["analysis_df"], index=False).to_numpy().tobytes())
+        hasher.update(repr(result["plates"]).encode())
+        digest = result["hash"] = hasher.hexdigest()
+    return digest
+
+
+def _heatmap_scale(metric, values):
+    """
+    將指標數值轉為 0-255 色階
+    Order 固定 1 (最亮) 到 4 (最暗);其餘指標依該 plate 的數值範圍
+    回傳:(色階陣列, 範圍下限標籤, 範圍上限標籤)
+    """
+    if metric == "Order":
+        scaled = (4 - values) / 3
+        return scaled, "Order 4", "Order 1"
+    finite = values[np.isfinite(values)]
+    lo, hi = (float(finite.min()), float(finite.max())) if finite.size else (0.0, 1.0)
+    span = hi - lo if hi > lo else 1.0
+    return (values - lo) / span, f"{lo:g}", f"{hi:g}"
+
+
+def _render_plate_heatmap(analysis_df, metric):
+    """以向量化運算繪製單一 plate 的熱圖,回傳 RGB 影像"""
+    n = len(analysis_df)
+    wells, rows, cols = plate_layout(n)
+    cell = _HEATMAP_CELL_PX.get(wells, _HEATMAP_CELL_PX[1536])
+
+    values = np.full(wells, np.nan)
+    values[:n] = analysis_df[HEATMAP_METRICS[metric]].to_numpy(dtype=np.float64)
+    error = np.zeros(wells, dtype=bool)
+    error[:n] = (analysis_df["Concentration Level"] == "Error").to_numpy()
+    empty = np.arange(wells) >= n
+    values[error] = np.nan
+
+    # 每孔一個像素套用色表,再以 np.repeat 放大成格子
+    scaled, lo_label, hi_label = _heatmap_scale(metric, values)
+    levels = np.nan_to_num(np.clip(scaled, 0, 1) * 255).astype(np.uint8)
+    colors = cv2.applyColorMap(levels.reshape(rows, cols), cv2.COLORMAP_VIRIDIS)[..., ::-1].copy()
+    colors.reshape(-1, 3)[error] = _HEATMAP_ERROR
+    colors.reshape(-1, 3)[empty] = _HEATMAP_EMPTY
+    grid = np.repeat(np.repeat(colors, cell, axis=0), cell, axis=1)
+    grid[::cell, :] = 255
+    grid[:, ::cell] = 255
+
+    height = _HEATMAP_MARGIN + rows * cell + _HEATMAP_MARGIN // 2
+    width = _HEATMAP_MARGIN + cols * cell + 1 + _HEATMAP_LEGEND_PX
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+    canvas[_HEATMAP_MARGIN:_HEATMAP_MARGIN + rows * cell, _HEATMAP_MARGIN:_HEATMAP_MARGIN + cols * cell] = grid
+
+    font_scale = 0.4 if cell >= 20 else 0.3
+    for c in range(cols):
+        if cell >= 20 or c % 2 == 0:
+            cv2.putText(canvas, str(c + 1), (_HEATMAP_MARGIN + c * cell + 2, _HEATMAP_MARGIN - 8),
+                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 1, cv2.LINE_AA)
+    for r in range(rows):
+        cv2.putText(canvas, _row_label(r), (4, _HEATMAP_MARGIN + r * cell + cell // 2 + 4),
+                    cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 0), 1, cv2.LINE_AA)
+
+    # 色階圖例:上端為最大值 (Order 為 1)
+    legend_x = _HEATMAP_MARGIN + cols * cell + 12
+    legend_h = rows * cell
+    ramp = np.linspace(255, 0, legend_h).astype(np.uint8).reshape(-1, 1)
+    ramp = cv2.applyColorMap(ramp, cv2.COLORMAP_VIRIDIS)[..., ::-1]
+    canvas[_HEATMAP_MARGIN:_HEATMAP_MARGIN + legend_h, legend_x:legend_x + 14] = np.repeat(ramp, 14, axis=1)
+    cv2.putText(canvas, hi_label, (legend_x, _HEATMAP_MARGIN - 8),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 1, cv2.LINE_AA)
+    cv2.putText(canvas, lo_label, (legend_x, _HEATMAP_MARGIN + legend_h + 11),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 1, cv2.LINE_AA)
+
+    canvas.setflags(write=False)
+    return canvas
+
+
+def plate_heatmap(result, plate_index, metric):
+    """
+    取得分析結果中某個 plate 的熱圖
+    參數:
+        - plate_index: result["plates"] 中的位置
+        - metric: HEATMAP_METRICS 之一
+    回傳:RGB 影像陣列 (Error 列為紅色、空孔為灰色)
+    """
+    key = (analysis_result_hash(result), plate_index, metric)
+    with _heatmap_cache_lock:
+        image = _heatmap_cache.get(key)
+        if image is not None:
+            _heatmap_cache.move_to_end(key)
+            return image
+
+    _, (start, stop), _ = result["plates"][plate_index]
+    image = _render_plate_heatmap(result["analysis_df"].iloc[start:stop], metric)
+
+    with _heatmap_cache_lock:
+        _heatmap_cache[key] = image
+        while len(_heatmap_cache) > HEATMAP_CACHE_SIZE:
+            _heatmap_cache.popitem(last=False)
+    return image
+
+
+# --- 3.7 Arrow / JSON Table Export ---
+
+# 備註:供下游排程程式讀取的表格,不需解析 Excel 的上下堆疊版面
+# analysis / grouping / priority 三張表,每張表都有 Row 欄 (= analysis 表的列位置) 可互相對應
+# Arrow 表格保留原始型別 (float32 比值、int8 Order、類別欄為 dictionary),可直接 memory-map 讀取
+# ⚠️ 欄位或結構變更時須調高 EXPORT_SCHEMA_VERSION
+EXPORT_SCHEMA_VERSION = 1
+EXPORT_TABLES = ("analysis", "grouping", "priority")
+
+
+def export_tables(result):
+    """
+    整理匯出用的三張表
+    回傳:dict - analysis (加上 Plate 欄) / grouping / priority
+    """
+    def with_row(df):
+        out = df.reset_index(names="Row")
+        out["Row"] = out["Row"].astype(np.int32)
+        return out
+
+    analysis = with_row(result["analysis_df"])
+    labels = [label for label, _, _ in result["plates"]]
+    counts = [stop - start for _, (start, stop), _ in result["plates"]]
+    analysis.insert(1, "Plate", pd.Categorical(np.repeat(np.array(labels, dtype=object), counts)))
+
+    priority = with_row(result["order_df"])
+    priority["Rank"] = priority["Rank"].astype(np.int32)
+
+    return {
+        "analysis": analysis,
+        "grouping": with_row(result["group_df"]),
+        "priority": priority,
+    }
+
+
+def _arrow_table(df, name, mode):
+    """DataFrame 轉 Arrow 表格,schema metadata 記錄版本、表名與分析模式"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update({
+        b"schema_version": str(EXPORT_SCHEMA_VERSION).encode(),
+        b"table": name.encode(),
+        b"mode": mode.encode(),
+    })
+    return table.replace_schema_metadata(metadata)
+
+
+def _write_arrow_file(table, sink):
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def write_arrow_tables(result, directory):
+    """
+    將三張表寫成 Arrow IPC 檔 (analysis.arrow / grouping.arrow / priority.arrow)
+    讀取:pa.ipc.open_file(pa.memory_map(path)).read_all()
+    回傳:檔案路徑 list
+    """
+    if pa is None:
+        raise ImportError("pyarrow is required for Arrow export")
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, df in export_tables(result).items():
+        path = os.path.join(directory, f"{name}.arrow")
+        with pa.OSFile(path, "wb") as sink:
+            _write_arrow_file(_arrow_table(df, name, result["mode"]), sink)
+        paths.append(path)
+    return paths
+
+
+def write_arrow_bundle(result, save_path):
+    """Arrow IPC 表格打包成一個 zip (不壓縮,解開後可直接 memory-map)"""
+    if pa is None:
+        raise ImportError("pyarrow is required for Arrow export")
+    with zipfile.ZipFile(save_path, "w", compression=zipfile.ZIP_STORED) as bundle:
+        for name, df in export_tables(result).items():
+            sink = pa.BufferOutputStream()
+            _write_arrow_file(_arrow_table(df, name, result["mode"]), sink)
+            bundle.writestr(f"{name}.arrow", sink.getvalue().to_pybytes())
+    return save_path
+
+
+def analysis_json(result):
+    """
+    精簡 JSON:{"schema_version", "mode", "tables": {名稱: {"columns": [...], "data": [[...], ...]}}}
+    每張表以 split 格式輸出,欄名只出現一次
+    """
+    body = ",".join(
+        f"{json.dumps(name)}:{_for_display(df).to_json(orient='split', index=False)}"
+        for name, df in export_tables(result).items()
+    )
+    return (
+        f'{{"schema_version":{EXPORT_SCHEMA_VERSION},'
+        f'"mode":{json.dumps(result["mode"])},"tables":{{{body}}}}}'
+    )
+
+
+def write_analysis_json(result, save_path):
+    with open(save_path, "w", encoding="utf-8") as fh:
+        fh.write(analysis_json(result))
+    return save_path
+
+
+def export_analysis(paths, output_dir=".", gel_image=None, profile=None, formats=("arrow", "json")):
+    """
+    不啟動介面,直接分析檔案並匯出表格 (供排程或其他程式呼叫)
+    參數:
+        - paths: Stunner 匯出檔路徑 list
+        - formats: "arrow" 及 / 或 "json"
+    回傳:寫出的檔案路徑 list
+    """
+    mode = "single" if len(paths) == 1 else "multiple"
+    result = analyze_files(paths, gel_image, mode=mode, profile=profile, incremental=False)
+    record_qc_rollup(result)
+    
+    written = []
+    if "arrow" in formats:
+        written.extend(write_arrow_tables(result, output_dir))
+    if "json" in formats:
+        os.makedirs(output_dir, exist_ok=True)
+        written.append(write_analysis_json(result, os.path.join(output_dir, "analysis.json")))
+    return written
+
+
+# --- 3.8 QC Trend Rollups ---
+
+# 備註:每次分析完成後,把結果彙總到「日期 × 儀器」的 rollup,不保留原始數據
+# 每個 rollup 只存計數、總和與固定區間直方圖 (可合併的分位數近似),趨勢圖直接由 rollup 計算
+# 品質計數在分析時由原始 float64 數值判定 (與載入時的 Quality Check 相同),ERROR 只計數值無法解析的列
+# 當日各 plate 的貢獻以「上傳內容 SHA-256 + plate 標籤」記錄,同一內容重新分析時取代舊貢獻而非重複累加;
+# 不同內容即使檔名相同 (例如 Plate1.xlsx) 也各自計入;
+# 過去日期的 rollup 不會再被取代,存檔時只保留當日的 plate 貢獻
+# 檔案為 ANALYSIS_DATA_DIR/qc_rollups.json,以暫存檔 + os.replace 原子寫入
+# 檔案損毀或版本不符時改名保留 (qc_rollups.json.bad-<時間>) 後從空白開始;無法讀取時本次執行不存檔,避免覆蓋歷史資料
+# ⚠️ 直方圖區間變更會使舊資料無法合併,須同時調高 ROLLUP_VERSION
+ROLLUP_VERSION = 1
+ROLLUP_PATH = os.path.join(ANALYSIS_DATA_DIR, "qc_rollups.json")
+ANALYSIS_INSTRUMENT = os.environ.get("ANALYSIS_INSTRUMENT", "default")
+ROLLUP_SKETCHES = {
+    # 名稱: (分析區塊欄位, 下限, 上限, 區間數);超出範圍的數值計入最外側區間
+    "concentration": ("con", 0.0, 500.0, 250),
+    "ratio_260_230": ("ratio_260_230", 0.0, 3.0, 150),
+}
+QC_TREND_METRICS = (
+    "Pass Rate (%)",
+    "Error Rate (%)",
+    "Mean Concentration",
+    "Median Concentration",
+    "Mean 260/230",
+    "Median 260/230",
+    "P10 260/230",
+)
+QC_TREND_RANGES = {"Last 30 days": 30, "Last 90 days": 90, "Last 365 days": 365, "All": None}
+_QUALITY_KEYS = ("PASS", "ACCEPTABLE", "FAIL", "ERROR")
+
+_rollup_state = None
+_rollup_save_blocked = False
+_rollup_lock = threading.Lock()
+
+
+def _empty_rollup(day, instrument):
+    return {
+        "date": day,
+        "instrument": instrument,
+        "runs": 0,
+        "samples": 0,
+        "quality": dict.fromkeys(_QUALITY_KEYS, 0),
+        "order": {str(order): 0 for order in range(1, 5)},
+        "sums": {name: 0.0 for name in ROLLUP_SKETCHES},
+        "counts": dict.fromkeys(ROLLUP_SKETCHES, 0),
+        "histograms": {name: [0] * bins for name, (_, _, _, bins) in ROLLUP_SKETCHES.items()},
+    }
+
+
+def _set_aside_rollups(reason):
+    """將無法使用的 rollup 檔改名保留;改名失敗時本次執行不存檔"""
+    global _rollup_save_blocked
+    target = f"{ROLLUP_PATH}.bad-{time.strftime('%Y%m%d-%H%M%S')}"
+    try:
+        os.replace(ROLLUP_PATH, target)
+    except OSError as e:
+        _rollup_save_blocked = True
+        logger.error("QC rollup file %s is %s and could not be moved aside (%s); rollups will not be saved",
+                     ROLLUP_PATH, reason, e)
+        return
+    logger.warning("QC rollup file %s is %s; moved to %s and starting a new history", ROLLUP_PATH, reason, target)
 
 
-# --- 2. Stunner Data Loading with Color Annotation ---
-def load_single_stunner(file_obj):
+def _load_rollups():
     """
-    載入單一 Stunner 檔案並標註品質
-    功能:讀取 Stunner 儀器導出的 Excel 並自動判定品質狀態
+    讀取 rollup 檔 (只在第一次使用時讀取)
+    功能:檔案不存在時從空白開始;損毀或版本不符時改名保留後從空白開始;無法讀取時不再存檔
     """
-    if file_obj is None:
-        return None, "Please select a file"
-    
+    global _rollup_state, _rollup_save_blocked
+    if _rollup_state is None:
+        state = {"version": ROLLUP_VERSION, "rollups": {}}
+        try:
+            with open(ROLLUP_PATH, encoding="utf-8") as fh:
+                stored = json.load(fh)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            _rollup_save_blocked = True
+            logger.error("QC rollup file %s could not be read (%s); rollups will not be saved", ROLLUP_PATH, e)
+        except ValueError:
+            _set_aside_rollups("corrupt")
+        else:
+            version = stored.get("version") if isinstance(stored, dict) else None
+            if version == ROLLUP_VERSION and isinstance(stored.get("rollups"), dict):
+                state = stored
+            else:
+                _set_aside_rollups(f"version {version!r} (expected {ROLLUP_VERSION})")
+        _rollup_state = state
+    return _rollup_state
+
+
+def _save_rollups(state):
+    directory = os.path.dirname(ROLLUP_PATH) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".qc_rollups_", suffix=".tmp")
     try:
-        # header=23 代表從第 24 行開始讀取數據
-        # 若 Stunner 儀器格式變更,需調整此數字
-        df = pd.read_excel(file_obj.name, header=23)
-        
-        # 新增兩個欄位用於品質判定
-        df['Quality Check'] = ''
-        df['Note'] = ''
-        
-        # 逐筆樣本進行品質判定
-        for i in range(len(df)):
-            try:
-                # ⚠️ iloc[i, 9]  → 濃度 (Concentration)
-                # ⚠️ iloc[i, 11] → 260/280 Ratio
-                # ⚠️ iloc[i, 12] → 260/230 Ratio
-                con = float(df.iloc[i, 9])
-                ratio_280_260 = float(df.iloc[i, 11])
-                ratio_260_230 = float(df.iloc[i, 12])
-                
-                issues = []
-                
-                # 濃度檢查
-                if con < 20:
-                    issues.append("Low concentration")
-                
-                # 260/280 檢查 - 正常範圍 1.8~2.0
-                if ratio_280_260 < 1.8:
-                    issues.append("260/280 too low")
-                
-                if ratio_280_260 > 2.0:
-                    issues.append("260/280 too high")
-                
-                # 260/230 檢查 - 正常範圍 ≥ 2.0
-                if ratio_260_230 < 2.0:
-                    issues.append("260/230 abnormal")
-                
-                # 評級標準
-                if len(issues) > 0:
-                    df.at[i, 'Quality Check'] = 'FAIL'
-                    df.at[i, 'Note'] = '; '.join(issues)
-                elif con >= 50 and ratio_280_260 >= 1.9 and ratio_260_230 >= 2.2:
-                    df.at[i, 'Quality Check'] = 'PASS'
-                    df.at[i, 'Note'] = 'Excellent quality'
-                else:
-                    df.at[i, 'Quality Check'] = 'ACCEPTABLE'
-                    df.at[i, 'Note'] = 'Meets minimum standard'
-                    
-            except:
-                df.at[i, 'Quality Check'] = 'ERROR'
-                df.at[i, 'Note'] = 'Cannot read values'
-        
-        # 套用顏色樣式
-        styled_df = style_dataframe(df)
-        success_msg = f"Successfully loaded {len(df)} samples"
-        return styled_df, success_msg
-    
-    except Exception as e:
-        error_msg = f"Loading failed: {str(e)}"
-        return None, error_msg
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            json.dump(state, fh, separators=(",", ":"))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, ROLLUP_PATH)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 
-def style_dataframe(df):
+def plate_qc_summary(block, profile):
     """
-    表格顏色標註函式
-    功能:根據品質判定結果上色,方便快速辨識
+    單一 plate 的 QC 彙總 (rollup 的一份貢獻)
+    功能:以分析區塊的 float64 數值判定品質,ERROR 為數值無法解析的列;直方圖只存非零區間
+    回傳:dict - samples / quality / order / sums / counts / histograms ([[區間, 計數], ...])
     """
-    def color_rows(row):
-        if 'Quality Check' not in row.index:
-            return [''] * len(row)
-        
-        quality = row['Quality Check']
-        
-        if quality == 'PASS':
-            return ['background-color: #90EE90'] * len(row)
-        elif quality == 'ACCEPTABLE':
-            return ['background-color: #87CEEB'] * len(row)
-        elif quality == 'FAIL':
-            return ['background-color: #FFB6C6'] * len(row)
-        elif quality == 'ERROR':
-            return ['background-color: #D3D3D3'] * len(row)
-        else:
-            return [''] * len(row)
-    
-    return df.style.apply(color_rows, axis=1)
+    raw_ok = block["raw_ok"]
+    quality_check, _ = profile.evaluate(block["con"], block["ratio_280_260"], block["ratio_260_230"], raw_ok)
+    quality_counts = pd.Series(quality_check).value_counts()
+    orders = np.bincount(block["order"].astype(np.int64), minlength=5)
+
+    summary = {
+        "samples": len(raw_ok),
+        "quality": {key: int(quality_counts.get(key, 0)) for key in _QUALITY_KEYS},
+        "order": {str(order): int(orders[order]) for order in range(1, 5)},
+        "sums": {},
+        "counts": {},
+        "histograms": {},
+    }
+    for name, (key, lo, hi, bins) in ROLLUP_SKETCHES.items():
+        values = np.asarray(block[key], dtype=np.float64)[raw_ok]
+        values = values[np.isfinite(values)]
+        hist, _ = np.histogram(np.clip(values, lo, hi), bins=bins, range=(lo, hi))
+        summary["sums"][name] = float(values.sum())
+        summary["counts"][name] = len(values)
+        summary["histograms"][name] = [[int(i), int(hist[i])] for i in np.flatnonzero(hist)]
+    return summary
+
 
+def _apply_qc_summary(entry, summary, sign):
+    """將一份 plate 貢獻加入 (sign=1) 或移出 (sign=-1) rollup"""
+    entry["samples"] += sign * summary["samples"]
+    for key, count in summary["quality"].items():
+        entry["quality"][key] += sign * count
+    for order, count in summary["order"].items():
+        entry["order"][order] += sign * count
+    for name in ROLLUP_SKETCHES:
+        entry["sums"][name] += sign * summary["sums"][name]
+        entry["counts"][name] += sign * summary["counts"][name]
+        hist = entry["histograms"][name]
+        for i, count in summary["histograms"][name]:
+            hist[i] += sign * count
 
-def load_multi_stunner(file_objs, selected_file_index):
+
+def record_qc_rollup(result, instrument=None, day=None):
     """
-    載入多個 Stunner 檔案並支援切換瀏覽
-    功能:處理多檔案上傳,允許使用者切換查看不同檔案
+    將一次分析結果併入當日 rollup 並存檔
+    參數:
+        - instrument: 儀器名稱,預設 ANALYSIS_INSTRUMENT
+        - day: "YYYY-MM-DD",預設今天
+    功能:同一天已記錄過的 plate (依上傳內容 SHA-256 與 plate 標籤) 以新結果取代舊貢獻;
+         全部 plate 都已記錄過時不增加 Runs
+    備註:存檔失敗 (或 rollup 檔無法讀取) 時只記錄在記憶體中並寫入 log,不影響分析結果
     """
-    if not file_objs:
-        return None, None, "Please upload files", []
-    
-    file_names = [f.name for f in file_objs]
-    
-    if selected_file_index is None:
-        selected_file_index = 0
-    
-    if selected_file_index >= len(file_objs):
-        selected_file_index = 0
-    
-    try:
-        df = pd.read_excel(file_objs[selected_file_index].name, header=23)
-        
-        df['Quality Check'] = ''
-        df['Note'] = ''
-        
-        for i in range(len(df)):
-            try:
-                con = float(df.iloc[i, 9])
-                ratio_280_260 = float(df.iloc[i, 11])
-                ratio_260_230 = float(df.iloc[i, 12])
-                
-                issues = []
-                
-                if con < 20:
-                    issues.append("Low concentration")
-                if ratio_280_260 < 1.8 or ratio_280_260 > 2.0:
-                    issues.append("260/280 abnormal")
-                if ratio_260_230 < 2.0:
-                    issues.append("260/230 abnormal")
-                
-                if len(issues) > 0:
-                    df.at[i, 'Quality Check'] = 'FAIL'
-                    df.at[i, 'Note'] = '; '.join(issues)
-                elif con >= 50 and ratio_280_260 >= 1.9 and ratio_260_230 >= 2.2:
-                    df.at[i, 'Quality Check'] = 'PASS'
-                    df.at[i, 'Note'] = 'Excellent quality'
-                else:
-                    df.at[i, 'Quality Check'] = 'ACCEPTABLE'
-                    df.at[i, 'Note'] = 'Meets minimum standard'
-                    
-            except:
-                df.at[i, 'Quality Check'] = 'ERROR'
-                df.at[i, 'Note'] = 'Cannot read values'
-        
-        styled_df = style_dataframe(df)
-        file_info = f"Viewing file {selected_file_index + 1} of {len(file_objs)}: {os.path.basename(file_names[selected_file_index])}"
-        
-        return styled_df, None, file_info, file_names
-        
-    except Exception as e:
-        error_msg = f"Error loading file: {str(e)}"
-        return None, None, error_msg, file_names
+    summaries = [
+        (key, summary)
+        for key, summary in zip(result["plate_keys"], result["plate_qc"])
+        if summary["samples"]
+    ]
+    if not summaries:
+        return
+    instrument = instrument or ANALYSIS_INSTRUMENT
+    day = day or time.strftime("%Y-%m-%d")
 
+    with _rollup_lock:
+        state = _load_rollups()
+        rollups = state["rollups"]
+        # 過去日期的 plate 貢獻不再需要
+        for other in rollups.values():
+            if other["date"] < day:
+                other.pop("plates", None)
 
-# --- 3. Master Analysis System with Separated Raw Data ---
-def run_master_analysis(file_objs, gel_image, mode="single"):
+        entry = rollups.setdefault(f"{day}|{instrument}", _empty_rollup(day, instrument))
+        recorded = entry.setdefault("plates", {})
+        if any(key not in recorded for key, _ in summaries):
+            entry["runs"] += 1
+        for key, summary in summaries:
+            previous = recorded.get(key)
+            if previous is not None:
+                _apply_qc_summary(entry, previous, -1)
+            _apply_qc_summary(entry, summary, 1)
+            recorded[key] = summary
+        if _rollup_save_blocked:
+            return
+        try:
+            _save_rollups(state)
+        except OSError as e:
+            logger.error("QC rollups could not be saved to %s (%s)", ROLLUP_PATH, e)
+
+
+def _histogram_quantile(hist, lo, hi, q):
+    """由固定區間直方圖估計分位數 (區間內線性內插)"""
+    hist = np.asarray(hist, dtype=np.float64)
+    total = hist.sum()
+    if total == 0:
+        return np.nan
+    cumulative = np.cumsum(hist)
+    target = q * total
+    idx = int(np.searchsorted(cumulative, target))
+    idx = min(idx, len(hist) - 1)
+    before = cumulative[idx - 1] if idx else 0.0
+    width = (hi - lo) / len(hist)
+    fraction = (target - before) / hist[idx] if hist[idx] else 0.0
+    return lo + (idx + fraction) * width
+
+
+def qc_trend_table(days=None, instrument=None):
     """
-    主分析系統 - 執行完整的品質分析流程
-    功能:整合濃度分析、電泳分析,生成完整報告
+    QC 趨勢表 (每個日期 × 儀器一列),只讀取 rollup
+    參數:
+        - days: 只取最近幾天,None 為全部
+        - instrument: 只取某一台儀器,None 為全部
     """
-    if not file_objs:
-        return None, None, None, None, None, "Please upload analysis files"
-    
-    all_results = []
-    all_raw_data = []
-    
-    # 處理每個上傳的檔案
-    for f in file_objs:
-        df_raw = pd.read_excel(f.name, header=23)
-        
-        for i in range(len(df_raw)):
-            current_sample = str(df_raw.iloc[i, 1])
-            
-            try:
-                con = float(df_raw.iloc[i, 9])
-                ratio_280_260 = float(df_raw.iloc[i, 11])
-                ratio_260_230 = float(df_raw.iloc[i, 12])
-                
-                # 保存 raw data
-                raw_row = [
-                    current_sample,
-                    con,
-                    ratio_280_260,
-                    ratio_260_230
-                ]
-                all_raw_data.append(raw_row)
-                
-                # 濃度分級
-                if con >= 50:
-                    con_level = "High"
-                elif con >= 20:
-                    con_level = "Medium"
-                else:
-                    con_level = "Low"
-
-                # 電泳分析
-                if con >= 20:
-                    if gel_image is not None:
-                        smear, integrity, order_val = analyze_gel_image(gel_image.name, i+1)
-                        e_val = f"{smear} / {integrity}"
-                        n_val = order_val
-                    else:
-                        e_val = "No Gel Image"
-                        n_val = "4"
-                else:
-                    e_val = "Concentration < 20"
-                    n_val = "4"
-
-                result_row = [
-                    current_sample, 
-                    con, 
-                    con_level, 
-                    ratio_280_260, 
-                    ratio_260_230,
-                    e_val, 
-                    n_val
-                ]
-                
-                all_results.append(result_row)
-                
-            except:
-                error_row = [
-                    current_sample, 
-                    0, 
-                    "Error", 
-                    0, 
-                    0, 
-                    "Error", 
-                    "4"
-                ]
-                all_results.append(error_row)
-
-    # 建立分析結果 DataFrame
-    analysis_df = pd.DataFrame(
-        all_results, 
-        columns=[
-            "Sample Name", 
-            "Concentration", 
-            "Concentration Level", 
-            "260/280", 
-            "260/230", 
-            "Electrophoresis", 
-            "Order"
-        ]
-    )
-    
-    # 建立原始數據 DataFrame
-    raw_data_df = pd.DataFrame(
-        all_raw_data,
-        columns=[
-            "Sample Name",
-            "Raw Concentration",
-            "Raw 260/280",
-            "Raw 260/230"
+    cutoff = None
+    if days is not None:
+        cutoff = time.strftime("%Y-%m-%d", time.localtime(time.time() - days * 86400))
+    _, con_lo, con_hi, _ = ROLLUP_SKETCHES["concentration"]
+    _, r230_lo, r230_hi, _ = ROLLUP_SKETCHES["ratio_260_230"]
+
+    with _rollup_lock:
+        entries = [
+            entry for entry in _load_rollups()["rollups"].values()
+            if (cutoff is None or entry["date"] >= cutoff)
+            and (not instrument or entry["instrument"] == instrument)
         ]
-    )
+        rows = [_trend_row(entry, con_lo, con_hi, r230_lo, r230_hi)
+                for entry in sorted(entries, key=lambda e: (e["date"], e["instrument"]))]
 
-    # 儲存到 Excel
-    if mode == "single":
-        save_path = os.path.abspath("Single_Analysis_Report.xlsx")
-    else:
-        save_path = os.path.abspath("Multiple_Analysis_Report.xlsx")
-    
-    with pd.ExcelWriter(save_path, engine='openpyxl') as writer:
-        raw_data_df.to_excel(writer, sheet_name='Analysis Report',
-                              index=False, startrow=0)
-        
-        separator_row = len(raw_data_df) + 2
-        
-        analysis_df.to_excel(writer, sheet_name='Analysis Report',
-                              index=False, startrow=separator_row)
+    columns = ["Date", "Instrument", "Runs", "Samples", *QC_TREND_METRICS,
+               *(f"Order {order}" for order in range(1, 5))]
+    return pd.DataFrame(rows, columns=columns)
 
-    # 建立濃度分組表
-    group_df = analysis_df[
-        [
-            "Sample Name", 
-            "Concentration", 
-            "Concentration Level", 
-            "260/230"
-        ]
-    ].copy()
-    
-    group_df = group_df.sort_values(
-        by=["Concentration Level", "260/230"], 
-        ascending=[False, False]
-    )
 
-    # 建立定序優先順序表
-    order_df = analysis_df[
-        [
-            "Sample Name", 
-            "Order", 
-            "Electrophoresis"
-        ]
-    ].copy()
-    
-    order_df = order_df.sort_values(by="Order")
-    order_df['Rank'] = range(1, len(order_df) + 1)
+def _trend_row(entry, con_lo, con_hi, r230_lo, r230_hi):
+    """由單一 rollup 計算趨勢表的一列"""
+    samples = entry["samples"]
+    counts, sums, hists = entry["counts"], entry["sums"], entry["histograms"]
 
-    # 建立預覽表
-    preview_df = analysis_df[
-        [
-            "Sample Name", 
-            "Concentration", 
-            "Concentration Level",
-            "Order"
-        ]
-    ].head(10)
+    def mean(name, digits):
+        return round(sums[name] / counts[name], digits) if counts[name] else np.nan
+
+    def rate(key):
+        return round(100 * entry["quality"][key] / samples, 1) if samples else np.nan
+
+    return {
+        "Date": pd.Timestamp(entry["date"]),
+        "Instrument": entry["instrument"],
+        "Runs": entry["runs"],
+        "Samples": samples,
+        "Pass Rate (%)": rate("PASS"),
+        "Error Rate (%)": rate("ERROR"),
+        "Mean Concentration": mean("concentration", 2),
+        "Median Concentration": round(_histogram_quantile(hists["concentration"], con_lo, con_hi, 0.5), 2),
+        "Mean 260/230": mean("ratio_260_230", 3),
+        "Median 260/230": round(_histogram_quantile(hists["ratio_260_230"], r230_lo, r230_hi, 0.5), 3),
+        "P10 260/230": round(_histogram_quantile(hists["ratio_260_230"], r230_lo, r230_hi, 0.1), 3),
+        **{f"Order {order}": entry["order"][str(order)] for order in range(1, 5)},
+    }
 
-    return analysis_df, save_path, group_df, order_df, preview_df, "Analysis completed"
+
+def qc_instruments():
+    """rollup 中出現過的儀器名稱"""
+    with _rollup_lock:
+        return sorted({entry["instrument"] for entry in _load_rollups()["rollups"].values()})
 
 
 # --- 4. Password Verification ---
@@ -724,6 +3417,14 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
         gr.Markdown("<h1 style='text-align:center;'>Analysis System</h1>")
         gr.Markdown("<p class='subtitle' style='text-align:center;'>Advanced Genomic Sample Quality Control Platform</p>")
         
+        with gr.Row():
+            qc_profile_selector = gr.Dropdown(
+                label="QC Profile",
+                choices=qc_profile_names(),
+                value=get_qc_profile().name,
+                interactive=True
+            )
+        
         with gr.Tabs():
             
             # ===== Tab 1: Stunner Data Viewer =====
@@ -739,7 +3440,7 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                             with gr.Row():
                                 with gr.Column(scale=2):
                                     stunner_file = gr.File(
-                                        label="Select Stunner Excel File", 
+                                        label="Select Stunner Export (Excel / CSV / TSV)", 
                                         file_count="single"
                                     )
                                     with gr.Row():
@@ -749,6 +3450,12 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                                             elem_classes="primary-btn",
                                             scale=2
                                         )
+                                        export_single_btn = gr.Button(
+                                            "Prepare Download",
+                                            elem_classes="download-btn",
+                                            visible=False,
+                                            scale=1
+                                        )
                                         download_single_btn = gr.DownloadButton(
                                             "Download Results",
                                             elem_classes="download-btn",
@@ -793,7 +3500,7 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                             )
                             
                             file_selector = gr.Radio(
-                                label="Select File to View",
+                                label="Select Plate to View",
                                 choices=[],
                                 interactive=True
                             )
@@ -809,6 +3516,32 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                                 wrap=True
                             )
                             
+                            gr.Markdown("### Search Samples Across All Plates")
+                            
+                            with gr.Row():
+                                sample_search_box = gr.Textbox(
+                                    label="Sample Name",
+                                    placeholder="Type a full name, prefix or any part of a name",
+                                    scale=3
+                                )
+                                sample_search_mode = gr.Radio(
+                                    label="Match",
+                                    choices=list(SEARCH_MODES),
+                                    value="Auto",
+                                    scale=2
+                                )
+                            
+                            sample_duplicates = gr.Textbox(
+                                label="Duplicate Sample Names",
+                                interactive=False,
+                                lines=3
+                            )
+                            
+                            sample_search_output = gr.Dataframe(
+                                label="Matching Samples (All Loaded Plates)",
+                                wrap=True
+                            )
+                            
                             with gr.Column(elem_classes="color-legend"):
                                 gr.Markdown("""
                                 **Quality Status Colors**
@@ -835,7 +3568,18 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                                 with gr.Column():
                                     single_gel_image = gr.Image(
                                         label="Upload Gel Image (Optional)", 
-                                        type="filepath"
+                                        type="filepath",
+                                        image_mode=None
+                                    )
+                                with gr.Column():
+                                    single_gel_preview = gr.Image(
+                                        label="Gel Preview (Lanes / 20k / 5k / 3k)",
+                                        interactive=False
+                                    )
+                                    single_gel_zoom = gr.Radio(
+                                        choices=list(GEL_PREVIEW_CHOICES),
+                                        value="1/4",
+                                        label="Preview Scale"
                                     )
                             
                             single_analyze_btn = gr.Button(
@@ -880,7 +3624,18 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                                 with gr.Column():
                                     multi_gel_image = gr.Image(
                                         label="Upload Gel Image (Optional)", 
-                                        type="filepath"
+                                        type="filepath",
+                                        image_mode=None
+                                    )
+                                with gr.Column():
+                                    multi_gel_preview = gr.Image(
+                                        label="Gel Preview (Lanes / 20k / 5k / 3k)",
+                                        interactive=False
+                                    )
+                                    multi_gel_zoom = gr.Radio(
+                                        choices=list(GEL_PREVIEW_CHOICES),
+                                        value="1/4",
+                                        label="Preview Scale"
                                     )
                             
                             multi_analyze_btn = gr.Button(
@@ -910,6 +3665,60 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                                 - Medium: 20 <= Concentration < 50 ng/uL
                                 - Low: Concentration < 20 ng/uL
                                 """)
+                    
+                    # Threshold Calibration
+                    with gr.TabItem("Threshold Calibration"):
+                        with gr.Column(elem_classes="card"):
+                            gr.Markdown("### Evaluate Threshold Combinations on Historical Plates")
+                            
+                            with gr.Row():
+                                with gr.Column():
+                                    calibration_files = gr.File(
+                                        label="Upload Historical Stunner Files", 
+                                        file_count="multiple"
+                                    )
+                                with gr.Column():
+                                    calibration_gel_image = gr.Image(
+                                        label="Upload Gel Image (Optional)", 
+                                        type="filepath",
+                                        image_mode=None
+                                    )
+                            
+                            # 每個門檻一個輸入框,可填多個候選值 (以逗號分隔)
+                            calibration_inputs = []
+                            threshold_names = list(QC_THRESHOLDS) + list(GEL_THRESHOLDS)
+                            for row_start in range(0, len(threshold_names), 3):
+                                with gr.Row():
+                                    for name in threshold_names[row_start:row_start + 3]:
+                                        calibration_inputs.append(gr.Textbox(
+                                            label=name.replace("_", " ").title(),
+                                            placeholder="Blank = current profile value"
+                                        ))
+                            
+                            calibrate_btn = gr.Button(
+                                "Run Threshold Sweep", 
+                                variant="primary", 
+                                elem_classes="primary-btn", 
+                                size="lg"
+                            )
+                            
+                            calibration_status = gr.Textbox(
+                                label="Calibration Status", 
+                                interactive=False,
+                                lines=2
+                            )
+                            
+                            calibration_output = gr.Dataframe(
+                                label="PASS/FAIL and Order Distribution per Threshold Setting"
+                            )
+                            
+                            with gr.Column(elem_classes="info-card"):
+                                gr.Markdown("""
+                                **How to Use**
+                                - Enter one or more comma-separated values per threshold (e.g. 1.8, 1.85, 1.9)
+                                - Every combination is evaluated in a single pass over the uploaded plates
+                                - Order columns require a gel image; without one every sample is Order 4
+                                """)
             
             # ===== Tab 3: Results and Download =====
             with gr.TabItem("Results and Download"):
@@ -920,8 +3729,24 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                         label="Full Analysis Data"
                     )
                     
+                    report_format = gr.Radio(
+                        choices=list(REPORT_FORMATS),
+                        value="Excel Workbook",
+                        label="Report Format"
+                    )
+                    
+                    prepare_report_btn = gr.Button(
+                        "Prepare Report",
+                        elem_classes="download-btn"
+                    )
+                    
                     download_file = gr.File(
-                        label="Download Complete Report (Excel)"
+                        label="Download Complete Report"
+                    )
+                    
+                    report_status = gr.Textbox(
+                        label="Report Status",
+                        interactive=False
                     )
                     
                     with gr.Column(elem_classes="info-card"):
@@ -930,6 +3755,10 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                         - Section 1: Raw Data (Original measurements)
                         - Blank Row: Separator
                         - Section 2: Analysis Results (Quality assessment and sequencing order)
+                        
+                        **Zip Bundle Structure**
+                        - One workbook per plate (Raw Data and Analysis sheets)
+                        - Summary.xlsx: sample counts per level and order for every plate
                         """)
             
             # ===== Tab 4: Sequencing Order =====
@@ -950,7 +3779,83 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                         - Order 4: Lowest priority (Quality issues or low concentration)
                         """)
             
-            # ===== Tab 5: Preview =====
+            # ===== Tab 5: Plate Heatmap =====
+            with gr.TabItem("Plate Heatmap"):
+                with gr.Column(elem_classes="card"):
+                    gr.Markdown("### Plate Layout Heatmap")
+                    
+                    with gr.Row():
+                        heatmap_plate = gr.Dropdown(
+                            label="Plate",
+                            choices=[],
+                            type="index",
+                            interactive=True
+                        )
+                        heatmap_metric = gr.Radio(
+                            choices=list(HEATMAP_METRICS),
+                            value="Concentration",
+                            label="Metric"
+                        )
+                    
+                    heatmap_output = gr.Image(
+                        label="Wells (row-major: A1, A2, ...)",
+                        interactive=False
+                    )
+                    
+                    with gr.Column(elem_classes="info-card"):
+                        gr.Markdown("""
+                        **Plate Layout**
+                        - Samples are placed row by row: A1-A12, then B1-B12 (96 wells) or A1-A24 (384 wells)
+                        - Red wells: analysis Error; gray wells: empty
+                        - Order: brightest = Order 1 (highest priority)
+                        """)
+            
+            # ===== Tab 6: QC Trends =====
+            with gr.TabItem("QC Trends"):
+                with gr.Column(elem_classes="card"):
+                    gr.Markdown("### Historical QC Trends")
+                    
+                    with gr.Row():
+                        trend_metric = gr.Dropdown(
+                            label="Metric",
+                            choices=list(QC_TREND_METRICS),
+                            value="Pass Rate (%)",
+                            interactive=True
+                        )
+                        trend_instrument = gr.Dropdown(
+                            label="Instrument",
+                            choices=["All"],
+                            value="All",
+                            interactive=True
+                        )
+                        trend_range = gr.Radio(
+                            choices=list(QC_TREND_RANGES),
+                            value="Last 90 days",
+                            label="Period"
+                        )
+                    
+                    refresh_trends_btn = gr.Button("Refresh Trends", elem_classes="download-btn")
+                    
+                    trend_plot = gr.LinePlot(
+                        x="Date",
+                        y="Value",
+                        color="Instrument",
+                        label="Daily Trend"
+                    )
+                    
+                    trend_table = gr.Dataframe(
+                        label="Daily Rollups"
+                    )
+                    
+                    with gr.Column(elem_classes="info-card"):
+                        gr.Markdown("""
+                        **QC Trends**
+                        - Every completed analysis is added to a daily rollup per instrument
+                        - Pass Rate: samples meeting all PASS thresholds of the selected QC profile
+                        - Medians and P10 are estimated from binned histograms
+                        """)
+            
+            # ===== Tab 7: Preview =====
             with gr.TabItem("Preview"):
                 with gr.Column(elem_classes="card"):
                     gr.Markdown("### Quick Data Overview")
@@ -984,9 +3889,28 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
                             
                             Optimal Concentration: 50 ng/uL for best results
                             """)
+        
+        # ===== Diagnostics =====
+        with gr.Accordion("Diagnostics", open=False):
+            profiling_toggle = gr.Checkbox(
+                label="Profile analysis requests",
+                value=request_profiling_enabled()
+            )
+            gr.Markdown(
+                f"Profiles are saved to `{os.path.abspath(PROFILE_DIR)}` "
+                f"(latest {PROFILE_KEEP} kept)"
+            )
 
     # === Hidden State ===
     file_index_state = gr.State(0)
+    single_load_state = gr.State(None)
+    # 備註:每個 session 的單檔匯出共用一個暫存資料夾,session 結束時刪除
+    single_export_dir_state = gr.State(
+        None,
+        delete_callback=lambda path: shutil.rmtree(path, ignore_errors=True) if path else None
+    )
+    analysis_token_state = gr.State(None)
+    sample_index_state = gr.State(None)
     
     # === Event Handlers ===
     
@@ -1000,7 +3924,8 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
     login_btn.click(
         handle_login, 
         inputs=pwd, 
-        outputs=[login_ui, main_ui, error_msg]
+        outputs=[login_ui, main_ui, error_msg],
+        api_name="login"
     )
     
     pwd.submit(
@@ -1010,97 +3935,344 @@ with gr.Blocks(title="Analysis System", css=custom_css) as demo:
     )
     
     # Single File Load
-    def handle_single_load(file_obj):
-        df, msg = load_single_stunner(file_obj)
+    # 備註:載入時只暫存表格,按下 Prepare Download 才寫出 Excel
+    def handle_single_load(file_obj, profile):
+        try:
+            file_obj = intake_upload(file_obj)
+        except UploadRejected as e:
+            return None, str(e), gr.update(visible=False), gr.update(visible=False), None
+        df, msg = load_single_stunner(file_obj, profile)
         if df is not None:
-            temp_path = os.path.abspath("Single_Stunner_Result.xlsx")
-            df.data.to_excel(temp_path, index=False)
-            return df, msg, gr.update(visible=True, value=temp_path)
-        return df, msg, gr.update(visible=False)
+            return df, msg, gr.update(visible=True), gr.update(visible=False), df.data
+        return df, msg, gr.update(visible=False), gr.update(visible=False), None
     
     load_single_btn.click(
         handle_single_load,
-        inputs=stunner_file,
-        outputs=[stunner_output, stunner_status, download_single_btn]
+        inputs=[stunner_file, qc_profile_selector],
+        outputs=[stunner_output, stunner_status, export_single_btn, download_single_btn, single_load_state]
+    )
+    
+    def handle_single_export(data, export_dir):
+        if data is None:
+            return gr.update(visible=False), export_dir
+        if export_dir is None or not os.path.isdir(export_dir):
+            export_dir = tempfile.mkdtemp(prefix="stunner_")
+        temp_path = os.path.join(export_dir, "Single_Stunner_Result.xlsx")
+        write_quality_export(data, temp_path)
+        return gr.update(visible=True, value=temp_path), export_dir
+    
+    export_single_btn.click(
+        handle_single_export,
+        inputs=[single_load_state, single_export_dir_state],
+        outputs=[download_single_btn, single_export_dir_state]
     )
     
     # Multiple Files Browser
-    def handle_multi_load(files):
+    # 備註:載入時同時建立跨 plate 樣本索引,搜尋時不再解析檔案
+    def handle_multi_load(files, profile):
         if not files:
-            return None, None, "Please upload files", gr.update(choices=[])
+            return None, None, "Please upload files", gr.update(choices=[]), None, ""
+        try:
+            files = intake_uploads(files)
+        except UploadRejected as e:
+            return None, None, str(e), gr.update(choices=[]), None, ""
         
-        file_names = [os.path.basename(f.name) for f in files]
-        df, _, msg, _ = load_multi_stunner(files, 0)
+        df, _, msg, plate_names = load_multi_stunner(files, 0, profile)
+        if not plate_names:
+            return df, None, msg, gr.update(choices=[]), None, ""
         
-        return df, None, msg, gr.update(choices=file_names, value=file_names[0])
+        index = build_sample_index(files, profile)
+        return (
+            df, None, msg,
+            gr.update(choices=plate_names, value=plate_names[0]),
+            index, index.duplicate_summary()
+        )
     
     load_multi_browser_btn.click(
         handle_multi_load,
-        inputs=stunner_multi_files,
-        outputs=[stunner_multi_output, file_index_state, multi_browser_status, file_selector]
+        inputs=[stunner_multi_files, qc_profile_selector],
+        outputs=[
+            stunner_multi_output, file_index_state, multi_browser_status, file_selector,
+            sample_index_state, sample_duplicates
+        ],
+        api_name="multi_load"
+    )
+    
+    def handle_sample_search(index, query, mode):
+        if index is None:
+            return None
+        return _for_display(index.search(query, mode))
+    
+    sample_search_box.change(
+        handle_sample_search,
+        inputs=[sample_index_state, sample_search_box, sample_search_mode],
+        outputs=sample_search_output
+    )
+    
+    sample_search_mode.change(
+        handle_sample_search,
+        inputs=[sample_index_state, sample_search_box, sample_search_mode],
+        outputs=sample_search_output
     )
     
-    def handle_file_selection(files, selected_name):
+    @profiled
+    def handle_file_selection(files, selected_name, profile):
         if not files or not selected_name:
             return None, "No file selected"
+        try:
+            files = intake_uploads(files)
+        except UploadRejected as e:
+            return None, str(e)
         
-        file_names = [os.path.basename(f.name) for f in files]
-        if selected_name in file_names:
-            idx = file_names.index(selected_name)
-            df, _, msg, _ = load_multi_stunner(files, idx)
+        plate_names = [label for label, _ in list_stunner_plates(files)]
+        if selected_name in plate_names:
+            idx = plate_names.index(selected_name)
+            df, _, msg, _ = load_multi_stunner(files, idx, profile)
             return df, msg
         return None, "File not found"
     
     file_selector.change(
         handle_file_selection,
-        inputs=[stunner_multi_files, file_selector],
-        outputs=[stunner_multi_output, multi_browser_status]
+        inputs=[stunner_multi_files, file_selector, qc_profile_selector],
+        outputs=[stunner_multi_output, multi_browser_status],
+        api_name="select_plate"
+    )
+    
+    # Gel Preview
+    def handle_gel_preview(files, gel_img, zoom):
+        if gel_img is None:
+            return None
+        try:
+            gel_img = intake_upload(gel_img, "gel")
+            files = intake_uploads(files)
+        except UploadRejected:
+            return None
+        return render_gel_preview(
+            gel_img,
+            scale=GEL_PREVIEW_CHOICES[zoom],
+            measured_lanes=measured_gel_lanes(files)
+        )
+    
+    for files_input, gel_input, zoom_input, preview_output_image in (
+        (single_analysis_file, single_gel_image, single_gel_zoom, single_gel_preview),
+        (multi_analysis_files, multi_gel_image, multi_gel_zoom, multi_gel_preview),
+    ):
+        for trigger in (files_input, gel_input, zoom_input):
+            trigger.change(
+                handle_gel_preview,
+                inputs=[files_input, gel_input, zoom_input],
+                outputs=preview_output_image
+            )
+    
+    # Diagnostics
+    profiling_toggle.change(
+        set_request_profiling,
+        inputs=profiling_toggle,
+        outputs=None
     )
     
+    # Plate Heatmap - 分析完成後更新 plate 清單,切換 plate / 指標時由快取取圖
+    def handle_heatmap(token, plate_index, metric):
+        result = get_analysis_result(token) if token else None
+        if result is None or plate_index is None or not result["plates"]:
+            return None
+        return plate_heatmap(result, plate_index, metric)
+    
+    def handle_heatmap_plates(token, metric):
+        result = get_analysis_result(token) if token else None
+        if result is None or not result["plates"]:
+            return gr.update(choices=[], value=None), None
+        labels = [label for label, _, _ in result["plates"]]
+        return gr.update(choices=labels, value=labels[0]), plate_heatmap(result, 0, metric)
+    
+    for heatmap_input in (heatmap_plate, heatmap_metric):
+        heatmap_input.change(
+            handle_heatmap,
+            inputs=[analysis_token_state, heatmap_plate, heatmap_metric],
+            outputs=heatmap_output
+        )
+    
+    # QC Trends - 由 rollup 計算,不重新讀取原始檔案
+    def handle_trends(metric, instrument, period):
+        table = qc_trend_table(
+            days=QC_TREND_RANGES[period],
+            instrument=None if instrument == "All" else instrument
+        )
+        series = table[["Date", "Instrument", metric]].rename(columns={metric: "Value"}).dropna()
+        choices = ["All", *qc_instruments()]
+        return (
+            series,
+            table,
+            gr.update(choices=choices, value=instrument if instrument in choices else "All")
+        )
+    
+    for trend_trigger in (refresh_trends_btn.click, trend_metric.change, trend_range.change, trend_instrument.change):
+        trend_trigger(
+            handle_trends,
+            inputs=[trend_metric, trend_instrument, trend_range],
+            outputs=[trend_plot, trend_table, trend_instrument]
+        )
+    
     # Single File Analysis
-    def handle_single_analysis(file_obj, gel_img):
+    @profiled
+    def handle_single_analysis(file_obj, gel_img, profile):
         if file_obj is None:
-            return None, None, None, None, None, "Please upload a file"
-        result = run_master_analysis([file_obj], gel_img, mode="single")
-        return result
+            return None, None, None, None, None, "Please upload a file", None
+        try:
+            file_obj = intake_upload(file_obj)
+            gel_img = intake_upload(gel_img, "gel")
+        except UploadRejected as e:
+            return None, None, None, None, None, str(e), None
+        try:
+            result = analyze_files([file_obj], gel_img, mode="single", profile=profile)
+        except Exception as e:
+            # 例如活頁簿沒有資料列或 worker 異常結束,於狀態欄顯示原因
+            return None, None, None, None, None, f"Analysis failed: {str(e)}", None
+        record_qc_rollup(result)
+        return (*analysis_outputs(result), cache_analysis_result(result))
     
     single_analyze_btn.click(
         handle_single_analysis,
-        inputs=[single_analysis_file, single_gel_image],
+        inputs=[single_analysis_file, single_gel_image, qc_profile_selector],
         outputs=[
             full_analysis_output,
             download_file,
             single_grouping_output,
             order_output,
             preview_output,
-            single_analysis_status
-        ]
+            single_analysis_status,
+            analysis_token_state
+        ],
+        api_name="single_analysis"
+    ).then(
+        handle_heatmap_plates,
+        inputs=[analysis_token_state, heatmap_metric],
+        outputs=[heatmap_plate, heatmap_output]
     )
     
     # Multiple Files Analysis
-    def handle_multi_analysis(files, gel_img):
+    @profiled
+    def handle_multi_analysis(files, gel_img, profile):
         if not files:
-            return None, None, None, None, None, "Please upload files"
-        result = run_master_analysis(files, gel_img, mode="multiple")
-        return result
+            return None, None, None, None, None, "Please upload files", None
+        try:
+            files = intake_uploads(files)
+            gel_img = intake_upload(gel_img, "gel")
+        except UploadRejected as e:
+            return None, None, None, None, None, str(e), None
+        try:
+            result = analyze_files(files, gel_img, mode="multiple", profile=profile)
+        except Exception as e:
+            # 例如活頁簿沒有資料列或 worker 異常結束,於狀態欄顯示原因
+            return None, None, None, None, None, f"Analysis failed: {str(e)}", None
+        record_qc_rollup(result)
+        return (*analysis_outputs(result), cache_analysis_result(result))
     
     multi_analyze_btn.click(
         handle_multi_analysis,
-        inputs=[multi_analysis_files, multi_gel_image],
+        inputs=[multi_analysis_files, multi_gel_image, qc_profile_selector],
         outputs=[
             full_analysis_output,
             download_file,
             multi_grouping_output,
             order_output,
             preview_output,
-            multi_analysis_status
-        ]
+            multi_analysis_status,
+            analysis_token_state
+        ],
+        api_name="multi_analysis"
+    ).then(
+        handle_heatmap_plates,
+        inputs=[analysis_token_state, heatmap_metric],
+        outputs=[heatmap_plate, heatmap_output]
+    )
+    
+    # Threshold Calibration
+    def handle_calibration(files, gel_img, profile, *grid_texts):
+        if not files:
+            return None, "Please upload files"
+        try:
+            files = intake_uploads(files)
+            gel_img = intake_upload(gel_img, "gel")
+        except UploadRejected as e:
+            return None, str(e)
+        
+        # 空白欄位沿用目前 profile 的門檻
+        defaults = {**get_qc_profile(profile).thresholds, **GEL_THRESHOLDS}
+        try:
+            grid = {name: _parse_grid_values(text) or [defaults[name]]
+                    for name, text in zip(defaults, grid_texts)}
+        except ValueError:
+            return None, "Threshold values must be numbers separated by commas"
+        
+        qc_grid = {name: grid[name] for name in QC_THRESHOLDS}
+        gel_grid = {name: grid[name] for name in GEL_THRESHOLDS}
+        try:
+            result = calibrate_thresholds(files, gel_img, qc_grid, gel_grid, profile=profile)
+        except Exception as e:
+            return None, f"Calibration failed: {str(e)}"
+        return result, f"Evaluated {len(result)} threshold settings"
+    
+    calibrate_btn.click(
+        handle_calibration,
+        inputs=[calibration_files, calibration_gel_image, qc_profile_selector, *calibration_inputs],
+        outputs=[calibration_output, calibration_status]
+    )
+    
+    # Report Download - 報告於點擊時才由暫存結果產生
+    def handle_report_download(token, fmt):
+        if token is None:
+            return None, "Please run an analysis first"
+        try:
+            path = get_analysis_report(token, REPORT_FORMATS[fmt])
+        except Exception as e:
+            return None, f"Report generation failed: {str(e)}"
+        if path is None:
+            return None, "Analysis result has expired, please run the analysis again"
+        return path, f"{fmt} ready"
+    
+    prepare_report_btn.click(
+        handle_report_download,
+        inputs=[analysis_token_state, report_format],
+        outputs=[download_file, report_status]
     )
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analysis System")
+    parser.add_argument("--export", nargs="+", metavar="FILE",
+                        help="analyze Stunner files without starting the UI and write Arrow / JSON tables")
+    parser.add_argument("--gel", default=None, help="gel image for --export")
+    parser.add_argument("--profile", default=None, help="QC profile for --export")
+    parser.add_argument("--output-dir", default=".", help="output directory for --export")
+    parser.add_argument("--format", choices=("arrow", "json", "all"), default="all",
+                        help="table format for --export")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    demo.launch(
-        share=False, 
-        server_name="127.0.0.1", 
-        server_port=7860
-    )
+    args = parse_args()
+    if args.export:
+        formats = ("arrow", "json") if args.format == "all" else (args.format,)
+        for path in export_analysis(args.export, args.output_dir, args.gel, args.profile, formats):
+            print(path)
+        sys.exit(0)
+    
+    # 備註:worker pool 隨伺服器啟動,伺服器結束 (或程序結束) 時關閉
+    # SIGTERM 比照 Ctrl+C 處理,讓 Gradio 正常關閉後再關閉 worker
+    start_worker_pool()
+    atexit.register(stop_worker_pool)
+    atexit.register(clear_report_cache)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    
+    # 備註:埠號可由環境變數覆寫 (壓力測試工具以此啟動獨立的伺服器)
+    # 單檔大小上限交給 Gradio 在接收上傳時檢查,超過上限的檔案不會寫入伺服器
+    try:
+        demo.launch(
+            share=False, 
+            server_name="127.0.0.1", 
+            server_port=int(os.environ.get("ANALYSIS_SERVER_PORT", "7860")),
+            max_file_size=int(UPLOAD_LIMITS["file_mb"] * 1024 * 1024)
+        )
+    finally:
+        stop_worker_pool()
@@ -0,0 +1,352 @@
+"""
+多使用者壓力測試工具
+功能:在本機啟動分析系統,以 gradio_client 模擬多個操作人員同時進行
+      登入 → 載入多檔 → 切換 plate → 多檔分析,統計延遲分位數、吞吐量與伺服器記憶體
+用法:
+    python load_test.py --sessions 8 --iterations 5
+    python load_test.py --url http://127.0.0.1:7860 --sessions 4   (測試已啟動的伺服器)
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+import pandas as pd
+from gradio_client import Client, handle_file
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_analysis.py")
+STUNNER_HEADER_ROW = 23
+STEPS = ("login", "multi_load", "select_plate", "multi_analysis")
+
+
+# ===========================
+# 1. 測試資料產生
+# ===========================
+
+def make_stunner_plate(rows, rng):
+    """
+    產生一個 Stunner 格式的 plate
+    欄位位置與儀器匯出檔相同:第 2 欄樣本名稱,第 10 / 12 / 13 欄為濃度與兩個比值
+    """
+    columns = [f"Column {i}" for i in range(14)]
+    columns[1], columns[9], columns[11], columns[12] = "Sample Name", "Concentration", "260/280", "260/230"
+    df = pd.DataFrame({c: ["-"] * rows for c in columns})
+    df["Sample Name"] = [f"S{rng.integers(1_000_000):06d}_{i}" for i in range(rows)]
+    df["Concentration"] = np.round(rng.uniform(5, 120, rows), 2)
+    df["260/280"] = np.round(rng.uniform(1.6, 2.2, rows), 3)
+    df["260/230"] = np.round(rng.uniform(1.5, 2.6, rows), 3)
+    return df
+
+
+def write_stunner_workbook(path, plates):
+    """寫出 Stunner 匯出檔:前 23 行為儀器資訊,第 24 行起為數據區,每個 plate 一個工作表"""
+    with pd.ExcelWriter(path) as writer:
+        for sheet, df in plates.items():
+            info = pd.DataFrame([[f"Instrument info {i}"] for i in range(STUNNER_HEADER_ROW)])
+            info.to_excel(writer, sheet_name=sheet, index=False, header=False)
+            df.to_excel(writer, sheet_name=sheet, index=False, startrow=STUNNER_HEADER_ROW)
+
+
+def write_gel_image(path, rng, total_lanes=14, lane_width=50, height=400):
+    """產生電泳影像:亮底暗帶,每條 Lane 在 20k / 5k / 3k 區域有隨機強度的條帶"""
+    img = np.full((height, total_lanes * lane_width), 230, np.uint8)
+    for lane in range(total_lanes):
+        x = lane * lane_width
+        for start in (0.175, 0.475, 0.675):
+            y = int(height * start)
+            img[y:y + 20, x + 10:x + lane_width - 10] = rng.integers(0, 150)
+    cv2.imwrite(path, img)
+
+
+def make_fixtures(workdir, files, plates_per_file, rows, seed):
+    """
+    建立測試上傳檔
+    回傳:(Stunner 檔案路徑 list, plate 標籤 list, 電泳影像路徑)
+    備註:plate 標籤與 read_stunner_plates 的命名規則相同,用於模擬切換 plate
+    """
+    rng = np.random.default_rng(seed)
+    paths, labels = [], []
+    for f in range(files):
+        name = f"load_test_{f + 1}.xlsx"
+        sheets = [f"Plate{p + 1}" for p in range(plates_per_file)]
+        write_stunner_workbook(os.path.join(workdir, name), {
+            sheet: make_stunner_plate(rows, rng) for sheet in sheets
+        })
+        paths.append(os.path.join(workdir, name))
+        labels.extend(name if len(sheets) == 1 else f"{name} [{sheet}]" for sheet in sheets)
+    gel_path = os.path.join(workdir, "load_test_gel.png")
+    write_gel_image(gel_path, rng)
+    return paths, labels, gel_path
+
+
+# ===========================
+# 2. 伺服器與記憶體監測
+# ===========================
+
+def start_server(port, startup_timeout, data_dir):
+    """
+    以子程序啟動分析系統,等待 HTTP 可連線後回傳 (Popen, url)
+    備註:未指定 ANALYSIS_DATA_DIR 時,伺服器資料 (上傳 intake 等) 寫到測試暫存資料夾
+    """
+    env = dict(os.environ, ANALYSIS_SERVER_PORT=str(port))
+    env.setdefault("ANALYSIS_DATA_DIR", data_dir)
+    proc = subprocess.Popen(
+        [sys.executable, APP_PATH],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}/"
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited during startup (code {proc.returncode})")
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return proc, url
+        except OSError:
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError(f"Server did not start within {startup_timeout}s")
+
+
+def process_rss(pid):
+    """
+    讀取程序常駐記憶體 (bytes),包含子程序
+    有 psutil 時使用 psutil,否則讀 /proc (僅主程序);無法讀取回傳 None
+    """
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            total = proc.memory_info().rss
+            for child in proc.children(recursive=True):
+                try:
+                    total += child.memory_info().rss
+                except psutil.Error:
+                    pass
+            return total
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RSSSampler(threading.Thread):
+    """背景定期取樣伺服器 RSS,記錄起始、峰值與結束值"""
+
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            rss = process_rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        rss = process_rss(self.pid)
+        if rss is not None:
+            self.samples.append(rss)
+
+
+# ===========================
+# 3. 模擬操作人員
+# ===========================
+
+class SessionStats:
+    """各步驟延遲 (秒) 與錯誤,所有 session 共用,以 lock 保護"""
+
+    def __init__(self):
+        self.latencies = {step: [] for step in STEPS}
+        self.errors = []
+        self.completed = 0
+        self._lock = threading.Lock()
+
+    def record(self, step, seconds):
+        with self._lock:
+            self.latencies[step].append(seconds)
+
+    def fail(self, session, step, exc):
+        with self._lock:
+            self.errors.append((session, step, f"{type(exc).__name__}: {exc}"))
+
+    def finish_iteration(self):
+        with self._lock:
+            self.completed += 1
+
+
+def run_session(session, url, files, plate_names, gel_path, args, stats, start_barrier):
+    """
+    單一操作人員流程 (每個 session 有自己的 Client,即獨立的 Gradio session)
+    每輪:登入 → 載入多檔 → 逐一切換 plate → 多檔分析
+    """
+    try:
+        client = Client(url, verbose=False)
+    except Exception as exc:
+        stats.fail(session, "connect", exc)
+        start_barrier.abort()
+        return
+
+    uploads = [handle_file(path) for path in files]
+    gel = handle_file(gel_path) if gel_path else None
+
+    def timed(step, **kwargs):
+        t0 = time.perf_counter()
+        result = client.predict(api_name=f"/{step}", **kwargs)
+        stats.record(step, time.perf_counter() - t0)
+        return result
+
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        return
+
+    for _ in range(args.iterations):
+        step = "login"
+        try:
+            timed("login", password=args.password)
+            step = "multi_load"
+            timed("multi_load", files=uploads, profile=args.profile)
+            step = "select_plate"
+            for name in plate_names[:args.plate_switches]:
+                timed("select_plate", files=uploads, selected_name=name, profile=args.profile)
+            step = "multi_analysis"
+            timed("multi_analysis", files=uploads, gel_img=gel, profile=args.profile)
+            stats.finish_iteration()
+        except Exception as exc:
+            stats.fail(session, step, exc)
+
+
+# ===========================
+# 4. 報告
+# ===========================
+
+def format_report(stats, wall_seconds, rss_samples, sessions):
+    lines = [f"Sessions: {sessions}   Wall time: {wall_seconds:.2f} s"]
+    lines.append(f"{'Step':<16}{'Count':>7}{'p50 (s)':>10}{'p90 (s)':>10}{'p99 (s)':>10}{'Max (s)':>10}")
+    total_requests = 0
+    for step in STEPS:
+        values = np.asarray(stats.latencies[step])
+        total_requests += len(values)
+        if len(values) == 0:
+            lines.append(f"{step:<16}{0:>7}")
+            continue
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        lines.append(f"{step:<16}{len(values):>7}{p50:>10.3f}{p90:>10.3f}{p99:>10.3f}{values.max():>10.3f}")
+
+    lines.append(f"Throughput: {total_requests / wall_seconds:.2f} requests/s, "
+                 f"{stats.completed / wall_seconds:.3f} full workflows/s "
+                 f"({stats.completed} completed)")
+    if rss_samples:
+        mib = 1024 * 1024
+        lines.append(f"Server RSS: start {rss_samples[0] / mib:.1f} MiB, "
+                     f"peak {max(rss_samples) / mib:.1f} MiB, end {rss_samples[-1] / mib:.1f} MiB")
+    else:
+        lines.append("Server RSS: unavailable (remote server or unsupported platform)")
+    if stats.errors:
+        lines.append(f"Errors: {len(stats.errors)}")
+        for session, step, message in stats.errors[:10]:
+            lines.append(f"  session {session} [{step}] {message}")
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-session load test for the analysis system")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent simulated operators")
+    parser.add_argument("--iterations", type=int, default=3, help="workflows per session")
+    parser.add_argument("--files", type=int, default=2, help="Stunner files uploaded per workflow")
+    parser.add_argument("--plates", type=int, default=2, help="plates (sheets) per file")
+    parser.add_argument("--rows", type=int, default=96, help="samples per plate")
+    parser.add_argument("--plate-switches", type=int, default=3, help="plate selections per workflow")
+    parser.add_argument("--no-gel", action="store_true", help="run analysis without a gel image")
+    parser.add_argument("--profile", default=None, help="QC profile name (default: server default)")
+    parser.add_argument("--password", default="980530", help="login password")
+    parser.add_argument("--url", default=None, help="existing server URL; omit to start one locally")
+    parser.add_argument("--port", type=int, default=7861, help="port for the locally started server")
+    parser.add_argument("--startup-timeout", type=float, default=120, help="seconds to wait for startup")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for synthetic uploads")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    proc = None
+    sampler = None
+    try:
+        files, plate_names, gel_path = make_fixtures(workdir, args.files, args.plates, args.rows, args.seed)
+        if args.no_gel:
+            gel_path = None
+
+        if args.url:
+            url = args.url
+        else:
+            proc, url = start_server(args.port, args.startup_timeout, os.path.join(workdir, "server_data"))
+            sampler = RSSSampler(proc.pid)
+            sampler.start()
+
+        stats = SessionStats()
+        # 備註:所有 session 建好連線後才同時開始,避免把 Client 建立時間算進吞吐量
+        start_barrier = threading.Barrier(args.sessions + 1)
+        threads = [
+            threading.Thread(
+                target=run_session,
+                args=(i, url, files, plate_names, gel_path, args, stats, start_barrier),
+                daemon=True
+            )
+            for i in range(args.sessions)
+        ]
+        for t in threads:
+            t.start()
+        try:
+            start_barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        t0 = time.perf_counter()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t0
+
+        rss_samples = []
+        if sampler is not None:
+            sampler.stop()
+            rss_samples = sampler.samples
+        print(format_report(stats, wall, rss_samples, args.sessions))
+        return 1 if stats.errors else 0
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())